@@ -0,0 +1,418 @@
+"""Stack pipeline shared by the egress and perimeter deployments.
+
+A pipeline deploys its stack definitions in order and feeds the outputs of upstream stacks into the
+parameters of downstream ones, either directly through create_stack/update_stack or, in plan mode,
+through change sets that are reported and approved before anything is executed. Each deployment.py
+supplies its stack definitions, any extra parameter sources and the hook run after a stack is deployed.
+"""
+import os
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError, WaiterError
+
+import log_pipeline
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+REPLACEMENT_VALUES = ("True", "Conditional")
+COMPLETE_STATUSES = ("CREATE_COMPLETE", "UPDATE_COMPLETE")
+REVIEW_STATUS = "REVIEW_IN_PROGRESS"  # Empty stack of an unexecuted CREATE change set
+
+
+class Pipeline:
+    """Deploy stack definitions in pipeline order, directly or through reviewed change sets.
+
+    parameter_sources maps a stack definition key (e.g. "parameters_from_registry") to a function
+    (stack_def, entry) returning the parameter value, or None after logging why it is unavailable.
+    after_stack(stack_def, collected_outputs) runs once a stack is deployed and its outputs collected.
+    """
+
+    def __init__(self, cf, stack_definitions, template_dir="templates", parameter_sources=None,
+                 after_stack=None, tag_tenant=False, force=False, execute=False):
+        self.cf = cf
+        self.stack_definitions = stack_definitions
+        self.template_dir = template_dir
+        self.parameter_sources = parameter_sources or {}
+        self.after_stack = after_stack
+        self.tag_tenant = tag_tenant  # Tag log records with the stack's ProjectName as the tenant
+        self.force = force  # Update stacks that are already complete
+        self.execute = execute  # Execute change sets without prompting
+
+    def stack_logger(self, stack_name, phase):
+        tenant = None
+        if self.tag_tenant:
+            stack_def = next((d for d in self.stack_definitions if d["name"] == stack_name), {})
+            tenant = next((p["ParameterValue"] for p in stack_def.get("parameters", [])
+                           if p["ParameterKey"] == "ProjectName"), None)
+        return log_pipeline.context_logger(logger, tenant=tenant, stack=stack_name, phase=phase)
+
+    # --- Stacks ---
+    def wait_for_completion(self, stack_name, operation, log=logger):
+        """Wait for a stack operation to complete; return False when it failed."""
+        waiter_name = 'stack_create_complete' if operation == 'create_stack' else 'stack_update_complete'
+        log.info(f"Waiting for {stack_name} to {operation.replace('_', ' ')}...")
+        try:
+            self.cf.get_waiter(waiter_name).wait(StackName=stack_name)
+        except WaiterError as e:
+            log.error(f"Error during stack wait: {e}")
+            return False
+        log.info(f"{stack_name} {operation.replace('_', ' ')} completed successfully.")
+        return True
+
+    def get_stack_status(self, stack_name):
+        try:
+            response = self.cf.describe_stacks(StackName=stack_name)
+            return response['Stacks'][0]['StackStatus']
+        except ClientError as e:
+            if 'does not exist' in str(e):
+                return None
+            logger.error(f"Failed to get status of stack {stack_name}: {e}")
+            return None
+
+    def get_stack_outputs(self, stack_name):
+        try:
+            response = self.cf.describe_stacks(StackName=stack_name)
+            return {o['OutputKey']: o['OutputValue'] for o in response['Stacks'][0].get('Outputs', [])}
+        except ClientError as e:
+            logger.error(f"Failed to get outputs for {stack_name}: {e}")
+            return {}
+
+    def collect_stack_outputs(self, stack_def, collected_outputs):
+        """Copy the declared outputs of a deployed stack into collected_outputs."""
+        outputs = self.get_stack_outputs(stack_def["name"])
+        for key in stack_def.get("outputs", []):
+            if key in outputs:
+                collected_outputs[key] = outputs[key]
+            else:
+                logger.warning(f"Output '{key}' not found in {stack_def['name']}")
+
+    def read_template(self, stack_def):
+        """Read and validate the template of a stack definition."""
+        template_path = os.path.join(self.template_dir, stack_def["template"])
+        if not os.path.isfile(template_path):
+            logger.error(f"Template file not found: {template_path}")
+            return None
+
+        with open(template_path, 'r') as f:
+            template_body = f.read()
+
+        try:
+            self.cf.validate_template(TemplateBody=template_body)
+        except ClientError as e:
+            logger.error(f"Template validation failed: {e}")
+            return None
+        return template_body
+
+    def resolve_parameters(self, stack_def, collected_outputs, quiet=False):
+        """Build the stack parameters, filling parameters_from_outputs from collected outputs
+        and every other source from its parameter_sources function.
+
+        Returns None when an upstream output or source value is not available.
+        """
+        stack_name = stack_def["name"]
+        parameters = list(stack_def.get("parameters", []))
+
+        for p in stack_def.get("parameters_from_outputs", []):
+            if "output_key" in p:
+                keys = [p["output_key"]]
+            elif "output_keys" in p:
+                keys = p["output_keys"]
+            else:
+                logger.error(f"Invalid parameter mapping in stack {stack_name}: {p}")
+                return None
+
+            missing = [k for k in keys if collected_outputs.get(k) is None]
+            if missing:
+                if not quiet:
+                    logger.error(f"Missing required output(s) {', '.join(missing)} for stack {stack_name}")
+                return None
+            parameters.append({
+                "ParameterKey": p["parameter_key"],
+                "ParameterValue": ",".join(collected_outputs[k] for k in keys)
+            })
+
+        for source, resolve in self.parameter_sources.items():
+            for p in stack_def.get(source, []):
+                value = resolve(stack_def, p)
+                if value is None:
+                    return None
+                parameters.append({"ParameterKey": p["parameter_key"], "ParameterValue": value})
+        return parameters
+
+    def discard_review_stack(self, stack_name, log=logger):
+        """Delete a stack left in REVIEW_IN_PROGRESS by an unexecuted CREATE change set.
+
+        Such a stack has no resources, but it blocks create_stack until it is deleted.
+        """
+        log.info(f"Deleting {stack_name}, left in REVIEW_IN_PROGRESS by an unexecuted change set")
+        try:
+            self.cf.delete_stack(StackName=stack_name)
+            self.cf.get_waiter('stack_delete_complete').wait(StackName=stack_name, WaiterConfig={'Delay': 5})
+            return True
+        except (ClientError, WaiterError) as e:
+            log.error(f"Failed to delete {stack_name}: {e}")
+            return False
+
+    def deploy_stack(self, stack_def, collected_outputs, wait=True):
+        """Create or update a stack; with wait=False only start the operation."""
+        stack_name = stack_def["name"]
+        log = self.stack_logger(stack_name, "deploy")
+
+        template_body = self.read_template(stack_def)
+        if template_body is None:
+            return False
+
+        parameters = self.resolve_parameters(stack_def, collected_outputs)
+        if parameters is None:
+            return False
+
+        stack_status = self.get_stack_status(stack_name)
+        if stack_status == REVIEW_STATUS and not self.discard_review_stack(stack_name, log):
+            return False
+        try:
+            if stack_status in (None, REVIEW_STATUS):
+                response = self.cf.create_stack(
+                    StackName=stack_name,
+                    TemplateBody=template_body,
+                    Parameters=parameters,
+                    Capabilities=['CAPABILITY_NAMED_IAM'],
+                    DisableRollback=True
+                )
+                log.info(f"Creating stack: {response['StackId']}")
+                return not wait or self.wait_for_completion(stack_name, 'create_stack', log)
+            if stack_status in COMPLETE_STATUSES:
+                if not self.force:
+                    log.info(f"Stack {stack_name} already exists. Skipping (use --force to override).")
+                    return True
+                self.cf.update_stack(
+                    StackName=stack_name,
+                    TemplateBody=template_body,
+                    Parameters=parameters,
+                    Capabilities=['CAPABILITY_NAMED_IAM']
+                )
+                log.info(f"Updating stack {stack_name}")
+                return not wait or self.wait_for_completion(stack_name, 'update_stack', log)
+            log.error(f"Stack {stack_name} is in unexpected state: {stack_status}")
+            return False
+        except ClientError as e:
+            if "No updates are to be performed" in str(e):
+                log.info(f"No updates needed for stack {stack_name}.")
+                return True
+            log.error(f"Error deploying stack {stack_name}: {e}")
+            return False
+
+    def deploy_all(self):
+        """Deploy every stack in order; return (ok, collected_outputs), with None outputs on failure."""
+        collected_outputs = {}
+        for stack_def in self.stack_definitions:
+            if not self.deploy_stack(stack_def, collected_outputs):
+                logger.error(f"Aborting due to failed {stack_def['name']} deployment.")
+                return False, None
+            self.collect_stack_outputs(stack_def, collected_outputs)
+            if self.after_stack:
+                self.after_stack(stack_def, collected_outputs)
+        return True, collected_outputs
+
+    # --- Change set planning ---
+    def get_known_outputs(self):
+        """Fetch the status and outputs of every stack concurrently; missing stacks have no outputs."""
+        def describe(stack_def):
+            try:
+                stack = self.cf.describe_stacks(StackName=stack_def["name"])['Stacks'][0]
+            except ClientError as e:
+                if 'does not exist' in str(e):
+                    return stack_def["name"], None, {}
+                raise
+            outputs = {o['OutputKey']: o['OutputValue'] for o in stack.get('Outputs', [])}
+            return stack_def["name"], stack['StackStatus'], outputs
+
+        statuses, collected_outputs = {}, {}
+        with ThreadPoolExecutor(max_workers=len(self.stack_definitions)) as pool:
+            for stack_def, (name, status, outputs) in zip(self.stack_definitions,
+                                                          pool.map(describe, self.stack_definitions)):
+                statuses[name] = status
+                collected_outputs.update({k: v for k, v in outputs.items() if k in stack_def.get("outputs", [])})
+        return statuses, collected_outputs
+
+    def create_change_set(self, stack_def, parameters, stack_status):
+        """Create a change set for one stack and return its planned resource changes."""
+        stack_name = stack_def["name"]
+        log = self.stack_logger(stack_name, "plan")
+        plan = {"stack": stack_name, "parameters": parameters, "changes": [], "error": None}
+
+        if stack_status in (None, REVIEW_STATUS):
+            plan["type"] = "CREATE"
+        elif stack_status in COMPLETE_STATUSES + ("UPDATE_ROLLBACK_COMPLETE",):
+            plan["type"] = "UPDATE"
+        else:
+            plan["error"] = f"stack is in unexpected state: {stack_status}"
+            return plan
+
+        template_body = self.read_template(stack_def)
+        if template_body is None:
+            plan["error"] = "template could not be read or validated"
+            return plan
+
+        plan["change_set_name"] = f"{stack_name}-plan-{int(time.time())}"
+        log.info(f"Creating {plan['type']} change set {plan['change_set_name']}")
+        try:
+            self.cf.create_change_set(
+                StackName=stack_name,
+                ChangeSetName=plan["change_set_name"],
+                ChangeSetType=plan["type"],
+                TemplateBody=template_body,
+                Parameters=parameters,
+                Capabilities=['CAPABILITY_NAMED_IAM']
+            )
+            self.cf.get_waiter('change_set_create_complete').wait(
+                StackName=stack_name,
+                ChangeSetName=plan["change_set_name"],
+                WaiterConfig={'Delay': 5}
+            )
+        except WaiterError as e:
+            reason = e.last_response.get('StatusReason', str(e))
+            if "didn't contain changes" in reason or "No updates are to be performed" in reason:
+                return plan
+            plan["error"] = reason
+            return plan
+        except ClientError as e:
+            plan["error"] = str(e)
+            return plan
+
+        kwargs = {"StackName": stack_name, "ChangeSetName": plan["change_set_name"]}
+        while True:
+            response = self.cf.describe_change_set(**kwargs)
+            plan["changes"].extend(c['ResourceChange'] for c in response.get('Changes', []))
+            if not response.get('NextToken'):
+                break
+            kwargs["NextToken"] = response['NextToken']
+        return plan
+
+    def report_plans(self, plans, waiting):
+        """Log adds, modifies, removes and replacements for every planned stack."""
+        logger.info("--- Change set plan ---")
+        for plan in plans:
+            if plan["error"]:
+                logger.error(f"{plan['stack']}: {plan['error']}")
+                continue
+            changes = plan["changes"]
+            adds = sum(1 for c in changes if c['Action'] == 'Add')
+            modifies = sum(1 for c in changes if c['Action'] == 'Modify')
+            removes = sum(1 for c in changes if c['Action'] == 'Remove')
+            replacements = [c for c in changes if c.get('Replacement') in REPLACEMENT_VALUES]
+            logger.info(f"{plan['stack']} ({plan['type']}): {adds} add, {modifies} modify, "
+                        f"{removes} remove, {len(replacements)} replacement")
+            for c in changes:
+                marker = " [REPLACEMENT]" if c in replacements else ""
+                logger.info(f"    {c['Action']:<7} {c['LogicalResourceId']} ({c['ResourceType']}){marker}")
+        for stack_def in waiting:
+            logger.info(f"{stack_def['name']}: waiting for upstream outputs, planned after upstream stacks run")
+        logger.info("-----------------------")
+
+    def approve_plans(self):
+        """Approve via --execute, or interactively when attached to a terminal."""
+        if self.execute:
+            return True
+        if not sys.stdin.isatty():
+            logger.info("Not attached to a terminal; re-run with --execute to apply the change sets.")
+            return False
+        return input("Execute these change sets? [y/N] ").strip().lower() in ("y", "yes")
+
+    def delete_change_set(self, plan, log=logger):
+        """Delete a planned change set; a failure is logged so one stale change set does not abort the plan."""
+        try:
+            self.cf.delete_change_set(StackName=plan["stack"], ChangeSetName=plan["change_set_name"])
+            log.info(f"Deleted change set {plan['change_set_name']}")
+        except ClientError as e:
+            log.warning(f"Failed to delete change set {plan['change_set_name']}: {e}")
+
+    def discard_plans(self, plans):
+        """Delete change sets that will not be executed, and the empty stacks their CREATE change sets made."""
+        for plan in plans:
+            if not plan.get("change_set_name"):
+                continue
+            log = self.stack_logger(plan["stack"], "discard")
+            if plan["type"] == "CREATE":
+                self.discard_review_stack(plan["stack"], log)
+            else:
+                self.delete_change_set(plan, log)
+
+    def execute_plan(self, plan):
+        """Execute a planned change set, or discard it when it has no changes."""
+        stack_name = plan["stack"]
+        log = self.stack_logger(stack_name, "execute")
+        if not plan["changes"]:
+            if plan.get("change_set_name"):
+                self.delete_change_set(plan, log)
+            log.info(f"No changes for stack {stack_name}.")
+            return True
+
+        kwargs = {"StackName": stack_name, "ChangeSetName": plan["change_set_name"]}
+        if plan["type"] == "CREATE":
+            kwargs["DisableRollback"] = True
+        try:
+            self.cf.execute_change_set(**kwargs)
+        except ClientError as e:
+            log.error(f"Error executing change set for {stack_name}: {e}")
+            return False
+        self.wait_for_completion(stack_name, 'create_stack' if plan["type"] == "CREATE" else 'update_stack', log)
+        return self.get_stack_status(stack_name) in COMPLETE_STATUSES
+
+    def run_plan(self):
+        """Plan every stack whose inputs are known, execute the approved change sets in pipeline order,
+        then plan the stacks that were waiting for upstream outputs.
+
+        Returns (ok, collected_outputs); collected_outputs is None when nothing was applied.
+        """
+        pending = list(self.stack_definitions)
+        while pending:
+            statuses, collected_outputs = self.get_known_outputs()
+            resolved = [(d, self.resolve_parameters(d, collected_outputs, quiet=True)) for d in pending]
+            plannable = [(d, params) for d, params in resolved if params is not None]
+            waiting = [d for d, params in resolved if params is None]
+            if not plannable:
+                logger.error(f"Cannot plan {', '.join(d['name'] for d in waiting)}: upstream outputs unavailable.")
+                return False, None
+
+            with ThreadPoolExecutor(max_workers=len(plannable)) as pool:
+                plans = list(pool.map(
+                    lambda item: self.create_change_set(item[0], item[1], statuses[item[0]["name"]]), plannable
+                ))
+            self.report_plans(plans, waiting)
+            if any(plan["error"] for plan in plans):
+                logger.error("Aborting plan due to failed change sets.")
+                self.discard_plans(plans)
+                return False, None
+            if not self.approve_plans():
+                self.discard_plans(plans)
+                return True, None
+
+            for (stack_def, parameters), plan in zip(plannable, plans):
+                # An executed upstream change set may have replaced resources whose IDs feed this stack
+                current = self.resolve_parameters(stack_def, collected_outputs, quiet=True)
+                if current != parameters:
+                    logger.info(f"Upstream outputs changed for {stack_def['name']}; it will be re-planned.")
+                    if plan.get("change_set_name"):
+                        self.delete_change_set(plan, self.stack_logger(stack_def["name"], "discard"))
+                    waiting.append(stack_def)
+                    continue
+                if not self.execute_plan(plan):
+                    logger.error(f"Aborting due to failed {stack_def['name']} change set.")
+                    return False, None
+                self.collect_stack_outputs(stack_def, collected_outputs)
+                if self.after_stack:
+                    self.after_stack(stack_def, collected_outputs)
+
+            pending = [d for d in self.stack_definitions if d in waiting]
+
+        collected_outputs = {}
+        for stack_def in self.stack_definitions:
+            self.collect_stack_outputs(stack_def, collected_outputs)
+        return True, collected_outputs
+
+    def run(self, plan=False):
+        """Deploy the pipeline, through change sets when plan is set; return (ok, collected_outputs)."""
+        return self.run_plan() if plan else self.deploy_all()
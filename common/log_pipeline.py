@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# --- Defaults ---
+LOG_DIR = "logs"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+CONTEXT_FIELDS = ("tenant", "stack", "phase")
+CONSOLE_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including the tenant/stack/phase context when present."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class ContextFormatter(logging.Formatter):
+    """Console format of the scripts, prefixed with [tenant/stack/phase] when the record has context."""
+
+    def format(self, record):
+        message = super().format(record)
+        context = "/".join(str(getattr(record, f)) for f in CONTEXT_FIELDS if getattr(record, f, None))
+        if not context:
+            return message
+        prefix_end = message.index(": ") + 2 if ": " in message else 0
+        return f"{message[:prefix_end]}[{context}] {message[prefix_end:]}"
+
+
+class TenantFileHandler(logging.Handler):
+    """Fan records tagged with a tenant out to <log_dir>/tenants/<tenant>.log.
+
+    Only the queue listener thread calls emit, so the per-tenant handlers need no extra locking.
+    """
+
+    def __init__(self, log_dir, formatter):
+        super().__init__()
+        self.directory = os.path.join(log_dir, "tenants")
+        self.formatter = formatter
+        self.handlers = {}
+
+    def emit(self, record):
+        tenant = getattr(record, "tenant", None)
+        if not tenant:
+            return
+        handler = self.handlers.get(tenant)
+        if handler is None:
+            os.makedirs(self.directory, exist_ok=True)
+            safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(tenant))
+            handler = logging.FileHandler(os.path.join(self.directory, f"{safe_name}.log"), encoding='utf-8')
+            handler.setFormatter(self.formatter)
+            self.handlers[tenant] = handler
+        handler.emit(record)
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        super().close()
+
+
+def setup_logging(main_log, level=logging.INFO, log_dir=LOG_DIR, stream=sys.stderr):
+    """Route all logging through a queue drained by a single writer thread.
+
+    Callers only pay for an enqueue; the listener writes JSON lines to a size-bounded rotating
+    <log_dir>/<main_log>, per-tenant files, and the usual console output on ``stream`` (None disables it).
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_queue = queue.SimpleQueue()
+
+    json_formatter = JsonFormatter()
+    main_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, main_log), maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding='utf-8'
+    )
+    main_handler.setFormatter(json_formatter)
+    handlers = [main_handler, TenantFileHandler(log_dir, json_formatter)]
+    if stream is not None:
+        console_handler = logging.StreamHandler(stream)
+        console_handler.setFormatter(ContextFormatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Flush queued records on exit, including sys.exit()
+    return listener
+
+
+def context_logger(logger, tenant=None, stack=None, phase=None):
+    """Return a logger that tags every record with the given tenant, stack and phase."""
+    extra = {k: v for k, v in (("tenant", tenant), ("stack", stack), ("phase", phase)) if v}
+    return logging.LoggerAdapter(logger, extra)
@@ -0,0 +1,200 @@
+"""Pre-flight validation of the resources referenced by the stack definitions.
+
+Every AMI, key pair, AZ, instance type and CIDR referenced by any stack is collected first and
+checked with a handful of batched describe calls run concurrently, so a bad reference fails the
+deployment in seconds instead of minutes into a create_stack that is left half-built.
+"""
+import logging
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError, BotoCoreError
+
+logger = logging.getLogger(__name__)
+
+
+def stack_parameters(stack_def, known_outputs):
+    """Return the parameter values of a stack that are known before it is deployed."""
+    values = {p["ParameterKey"]: p["ParameterValue"] for p in stack_def.get("parameters", [])}
+    for p in stack_def.get("parameters_from_outputs", []):
+        keys = p.get("output_keys") or [p.get("output_key")]
+        if all(k in known_outputs for k in keys):
+            values[p["parameter_key"]] = ",".join(known_outputs[k] for k in keys)
+    return values
+
+
+def split(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def collect_references(stack_defs, known_outputs):
+    """Gather everything the describe calls must verify, across all stacks."""
+    refs = {"amis": set(), "key_pairs": set(), "instance_types": set(), "azs": set(), "subnet_lists": []}
+    for stack_def in stack_defs:
+        values = stack_parameters(stack_def, known_outputs)
+        if values.get("AmiId"):
+            refs["amis"].add(values["AmiId"])
+        if values.get("KeyPairName"):
+            refs["key_pairs"].add(values["KeyPairName"])
+        if values.get("InstanceType"):
+            refs["instance_types"].add(values["InstanceType"])
+        refs["azs"].update(split(values.get("AvailabilityZones", "")))
+        # Subnet lists passed to the same stack are indexed together, so their AZ order must match
+        subnet_lists = {
+            p["parameter_key"]: split(values[p["parameter_key"]])
+            for p in stack_def.get("parameters_from_outputs", [])
+            if p.get("output_keys") and values.get(p["parameter_key"], "").startswith("subnet-")
+        }
+        if len(subnet_lists) > 1:
+            refs["subnet_lists"].append((stack_def["name"], subnet_lists))
+    return refs
+
+
+def check_cidrs(stack_def, known_outputs):
+    """Check that subnet CIDRs are valid, inside the VPC, non-overlapping and one per AZ."""
+    values = stack_parameters(stack_def, known_outputs)
+    if "VpcCidr" not in values:
+        return []
+    name = stack_def["name"]
+    try:
+        vpc = ipaddress.ip_network(values["VpcCidr"])
+    except ValueError as e:
+        return [f"{name}: invalid VpcCidr: {e}"]
+
+    problems, subnets = [], []
+    az_count = len(split(values.get("AvailabilityZones", "")))
+    for key, value in values.items():
+        if not key.endswith("SubnetCidrs"):
+            continue
+        cidrs = split(value)
+        if az_count and len(cidrs) != az_count:
+            problems.append(f"{name}: {key} has {len(cidrs)} CIDR(s) for {az_count} AZ(s)")
+        for cidr in cidrs:
+            try:
+                network = ipaddress.ip_network(cidr)
+            except ValueError as e:
+                problems.append(f"{name}: invalid CIDR in {key}: {e}")
+                continue
+            if not network.subnet_of(vpc):
+                problems.append(f"{name}: {key} {cidr} is outside VpcCidr {vpc}")
+            subnets.append((key, network))
+
+    for i, (key_a, a) in enumerate(subnets):
+        for key_b, b in subnets[i + 1:]:
+            if a.overlaps(b):
+                problems.append(f"{name}: {key_a} {a} overlaps {key_b} {b}")
+    return problems
+
+
+def describe_images(ec2, amis):
+    response = ec2.describe_images(Filters=[{"Name": "image-id", "Values": sorted(amis)}])
+    return {i["ImageId"]: i for i in response.get("Images", [])}
+
+
+def describe_key_pairs(ec2, names):
+    response = ec2.describe_key_pairs(Filters=[{"Name": "key-name", "Values": sorted(names)}])
+    return {k["KeyName"] for k in response.get("KeyPairs", [])}
+
+
+def describe_azs(ec2, azs):
+    response = ec2.describe_availability_zones(Filters=[{"Name": "zone-name", "Values": sorted(azs)}])
+    return {z["ZoneName"]: z["State"] for z in response.get("AvailabilityZones", [])}
+
+
+def describe_offerings(ec2, instance_types, azs):
+    offerings = set()
+    paginator = ec2.get_paginator("describe_instance_type_offerings")
+    for page in paginator.paginate(
+        LocationType="availability-zone",
+        Filters=[
+            {"Name": "instance-type", "Values": sorted(instance_types)},
+            {"Name": "location", "Values": sorted(azs)}
+        ]
+    ):
+        offerings.update((o["InstanceType"], o["Location"]) for o in page.get("InstanceTypeOfferings", []))
+    return offerings
+
+
+def describe_instance_types(ec2, instance_types):
+    response = ec2.describe_instance_types(InstanceTypes=sorted(instance_types))
+    return {t["InstanceType"]: t["ProcessorInfo"]["SupportedArchitectures"] for t in response.get("InstanceTypes", [])}
+
+
+def describe_subnet_azs(ec2, subnet_ids):
+    response = ec2.describe_subnets(SubnetIds=sorted(subnet_ids))
+    return {s["SubnetId"]: s["AvailabilityZone"] for s in response.get("Subnets", [])}
+
+
+def run(ec2, stack_defs, known_outputs=None):
+    """Validate every stack definition; log each problem and return True when there are none."""
+    known_outputs = known_outputs or {}
+    refs = collect_references(stack_defs, known_outputs)
+    problems = [p for stack_def in stack_defs for p in check_cidrs(stack_def, known_outputs)]
+
+    subnet_ids = {s for _, lists in refs["subnet_lists"] for ids in lists.values() for s in ids}
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        calls = {}
+        if refs["amis"]:
+            calls["images"] = pool.submit(describe_images, ec2, refs["amis"])
+        if refs["key_pairs"]:
+            calls["key_pairs"] = pool.submit(describe_key_pairs, ec2, refs["key_pairs"])
+        if refs["azs"]:
+            calls["azs"] = pool.submit(describe_azs, ec2, refs["azs"])
+        if refs["instance_types"]:
+            calls["types"] = pool.submit(describe_instance_types, ec2, refs["instance_types"])
+            if refs["azs"]:
+                calls["offerings"] = pool.submit(describe_offerings, ec2, refs["instance_types"], refs["azs"])
+        if subnet_ids:
+            calls["subnets"] = pool.submit(describe_subnet_azs, ec2, subnet_ids)
+        results = {}
+        for key, future in calls.items():
+            try:
+                results[key] = future.result()
+            except (ClientError, BotoCoreError) as e:
+                problems.append(f"Pre-flight lookup '{key}' failed: {e}")
+
+    images = results.get("images")
+    if images is not None:
+        for ami in sorted(refs["amis"]):
+            if ami not in images:
+                problems.append(f"AMI {ami} does not exist or is not shared with this account")
+            elif images[ami]["State"] != "available":
+                problems.append(f"AMI {ami} is {images[ami]['State']}")
+
+    if "key_pairs" in results:
+        problems += [f"Key pair '{k}' does not exist" for k in sorted(refs["key_pairs"] - results["key_pairs"])]
+
+    if "azs" in results:
+        for az in sorted(refs["azs"]):
+            state = results["azs"].get(az)
+            if state != "available":
+                problems.append(f"AZ {az} is {state or 'not in this region'}")
+
+    types = results.get("types")
+    if types is not None:
+        for instance_type in sorted(refs["instance_types"]):
+            if instance_type not in types:
+                problems.append(f"Instance type {instance_type} does not exist")
+            elif images:
+                for ami in sorted(a for a in refs["amis"] if a in images):
+                    if images[ami]["Architecture"] not in types[instance_type]:
+                        problems.append(f"AMI {ami} ({images[ami]['Architecture']}) cannot run on {instance_type}")
+
+    if "offerings" in results:
+        for instance_type in sorted(refs["instance_types"]):
+            missing = [az for az in sorted(refs["azs"]) if (instance_type, az) not in results["offerings"]]
+            if missing:
+                problems.append(f"Instance type {instance_type} is not offered in {', '.join(missing)}")
+
+    if "subnets" in results:
+        for stack_name, lists in refs["subnet_lists"]:
+            orders = {key: [results["subnets"].get(s, "?") for s in ids] for key, ids in lists.items()}
+            first_key, first_order = next(iter(orders.items()))
+            for key, order in orders.items():
+                if order != first_order:
+                    problems.append(f"{stack_name}: {key} AZ order {order} does not match {first_key} {first_order}")
+
+    for problem in problems:
+        logger.error(f"[PREFLIGHT] {problem}")
+    if not problems:
+        logger.info(f"[PREFLIGHT] {len(stack_defs)} stack definition(s) passed ({', '.join(calls) or 'no'} lookups).")
+    return not problems
@@ -0,0 +1,117 @@
+"""Publish and resolve the perimeter outputs shared with the egress deployments.
+
+perimeter_security_setup/deployment.py publishes the GWLB service outputs to SSM Parameter Store
+(``<prefix>/<ProjectName>/<OutputKey>``) or to a local JSON file stand-in. Resolved values are
+cached in memory and on disk for ``ttl`` seconds so fleet rollouts resolve the service once
+instead of once per tenant.
+
+The parameters live in the perimeter account, so callers running with tenant credentials
+must pass a ``profile`` of the perimeter account to read them.
+"""
+import os
+import json
+import time
+import logging
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_PREFIX = "/cf-tenant-network-security"  # SSM path: <prefix>/<ProjectName>/<OutputKey>
+CACHE_FILE = ".service-registry-cache.json"
+DEFAULT_TTL = 300  # seconds
+
+_memory_cache = {}  # 'source|[profile|][region|]project' -> (fetched_at, values)
+
+
+def _read_cache_file():
+    if not os.path.isfile(CACHE_FILE):
+        return {}
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    """Write through a temporary file so concurrent readers never see a truncated file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _write_cache_file(cache):
+    _write_json(CACHE_FILE, cache)
+
+
+def _fetch(source, project, region=None, profile=None):
+    """Read every published output of a project with a single call."""
+    if source.startswith("file:"):
+        with open(source[len("file:"):], 'r') as f:
+            return json.load(f).get(project, {})
+
+    ssm = boto3.Session(profile_name=profile, region_name=region).client('ssm')
+    path = f"{REGISTRY_PREFIX}/{project}/"
+    values = {}
+    for page in ssm.get_paginator('get_parameters_by_path').paginate(Path=path):
+        for parameter in page.get('Parameters', []):
+            values[parameter['Name'][len(path):]] = parameter['Value']
+    return values
+
+
+def publish(project, values, source="ssm", region=None, profile=None):
+    """Publish outputs of a project; raises ClientError, OSError or ValueError when they cannot be written."""
+    if source.startswith("file:"):
+        path = source[len("file:"):]
+        registry = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                registry = json.load(f)
+        registry.setdefault(project, {}).update(values)
+        _write_json(path, registry)
+        logger.info(f"Published {', '.join(values)} for {project} to {path}")
+        return
+
+    ssm = boto3.Session(profile_name=profile, region_name=region).client('ssm')
+    for key, value in values.items():
+        ssm.put_parameter(Name=f"{REGISTRY_PREFIX}/{project}/{key}", Value=value, Type='String', Overwrite=True)
+    logger.info(f"Published {', '.join(values)} under {REGISTRY_PREFIX}/{project}/")
+
+
+def resolve(project, key, source="ssm", ttl=DEFAULT_TTL, region=None, profile=None, refresh=False):
+    """Return a published output, using the in-memory and on-disk caches while they are fresh.
+
+    ``profile`` selects the AWS profile of the perimeter account for SSM reads.
+    """
+    scope = [s for s in (source, profile, region) if s]
+    cache_key = "|".join(scope + [project])
+    now = time.time()
+
+    entry = None if refresh else _memory_cache.get(cache_key)
+    if entry is None and not refresh:
+        cached = _read_cache_file().get(cache_key)
+        if cached:
+            entry = (cached["fetched_at"], cached["values"])
+
+    if entry is None or now - entry[0] > ttl or key not in entry[1]:
+        try:
+            values = _fetch(source, project, region, profile)
+        except (ClientError, OSError, ValueError) as e:
+            if entry and key in entry[1]:
+                logger.warning(f"Service registry refresh failed, using cached value: {e}")
+                return entry[1][key]
+            raise
+        entry = (now, values)
+        cache = _read_cache_file()
+        cache[cache_key] = {"fetched_at": now, "values": values}
+        _write_cache_file(cache)
+        logger.info(f"Resolved {len(values)} registry value(s) for {project} from {source}")
+
+    _memory_cache[cache_key] = entry
+    if key not in entry[1]:
+        account = f" (profile {profile})" if profile else " (current credentials)"
+        raise KeyError(f"'{key}' is not published for {project} in {source}{account}")
+    return entry[1][key]
@@ -0,0 +1,265 @@
+import os
+import sys
+import gzip
+import json
+import logging
+import argparse
+import ipaddress
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+# --- Logging setup ---
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+CHUNK_BYTES = 8 * 1024 * 1024  # Decompressed bytes read per chunk
+DEFAULT_FIELDS = [  # Field order of the default flow log format, used when a file has no header
+    "version", "account-id", "interface-id", "srcaddr", "dstaddr", "srcport", "dstport",
+    "protocol", "packets", "bytes", "start", "end", "action", "log-status"
+]
+REQUIRED_FIELDS = ("account-id", "interface-id", "srcaddr", "dstaddr", "packets", "bytes")
+
+
+@lru_cache(maxsize=65536)
+def is_private(address):
+    try:
+        return ipaddress.ip_address(address).is_private
+    except ValueError:
+        return False
+
+
+def find_log_files(paths):
+    """Expand files and directories into the list of flow log files to read."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.endswith((".log.gz", ".gz", ".log")))
+        else:
+            files.append(path)
+    return files
+
+
+def analyze_file(path):
+    """Aggregate one flow log file chunk by chunk and return mergeable counters."""
+    by_eni = defaultdict(lambda: [0, 0, 0])  # (account, eni, az) -> [bytes, packets, flows], both directions
+    counted = defaultdict(lambda: [0, 0, 0])  # (account, az) -> [bytes, packets, flows], each flow once
+    talkers = Counter()  # srcaddr -> bytes, each flow once
+    ingress = defaultdict(lambda: [0, 0, 0])  # (account, az, srcaddr) -> [bytes, packets, flows], counted after merge
+    egress_sources = set()  # addresses seen as the source of an egress record, i.e. monitored ENIs
+    local_az = {}  # address owned by an ENI -> az-id
+    peer_bytes = Counter()  # (az-id, private peer address) -> egress bytes
+    records = skipped = 0
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        first = f.readline()
+        fields = first.split()
+        if fields and fields[0] == "version":
+            pending = []
+        else:
+            pending = [first]
+            fields = DEFAULT_FIELDS
+        if any(k not in fields for k in REQUIRED_FIELDS):
+            logger.warning(f"{path}: missing required fields, skipping file")
+            return None
+
+        idx = {name: i for i, name in enumerate(fields)}
+        i_acct, i_eni = idx["account-id"], idx["interface-id"]
+        i_src, i_dst = idx["srcaddr"], idx["dstaddr"]
+        i_pkts, i_bytes = idx["packets"], idx["bytes"]
+        i_az, i_dir = idx.get("az-id"), idx.get("flow-direction")
+        width = len(fields)
+        if i_dir is None:
+            logger.warning(f"{path}: no flow-direction field, flows between monitored ENIs are counted twice")
+
+        while True:
+            lines = pending or f.readlines(CHUNK_BYTES)
+            pending = []
+            if not lines:
+                break
+            for line in lines:
+                cols = line.split()
+                if len(cols) != width or cols[i_bytes] == "-":  # NODATA / SKIPDATA records
+                    skipped += 1
+                    continue
+                try:
+                    nbytes, packets = int(cols[i_bytes]), int(cols[i_pkts])
+                except ValueError:  # Malformed row
+                    skipped += 1
+                    continue
+                records += 1
+                az = cols[i_az] if i_az is not None else "-"
+                entry = by_eni[(cols[i_acct], cols[i_eni], az)]
+                entry[0] += nbytes
+                entry[1] += packets
+                entry[2] += 1
+
+                # A flow between two monitored ENIs is logged as egress on the sender and ingress on the
+                # receiver. Tenant/AZ totals and talkers count the egress record, and an ingress record only
+                # when its sender is not a monitored ENI; that is known once every file is merged.
+                if i_dir is None or cols[i_dir] == "egress":
+                    entry = counted[(cols[i_acct], az)]
+                    entry[0] += nbytes
+                    entry[1] += packets
+                    entry[2] += 1
+                    talkers[cols[i_src]] += nbytes
+                    if i_dir is not None:
+                        egress_sources.add(cols[i_src])
+                else:
+                    entry = ingress[(cols[i_acct], az, cols[i_src])]
+                    entry[0] += nbytes
+                    entry[1] += packets
+                    entry[2] += 1
+
+                if i_dir is None or az == "-":
+                    continue
+                # The ENI owns srcaddr on egress records and dstaddr on ingress records. Only egress
+                # records feed the cross-AZ totals so each flow is counted once.
+                if cols[i_dir] == "egress":
+                    local_az[cols[i_src]] = az
+                    if is_private(cols[i_dst]):
+                        peer_bytes[(az, cols[i_dst])] += nbytes
+                else:
+                    local_az[cols[i_dst]] = az
+
+    return {
+        "by_eni": dict(by_eni), "counted": dict(counted), "talkers": talkers, "ingress": dict(ingress),
+        "egress_sources": egress_sources, "local_az": local_az, "peer_bytes": peer_bytes, "records": records,
+        "skipped": skipped, "undirected_files": int(i_dir is None)
+    }
+
+
+def merge_results(results):
+    merged = {
+        "by_eni": defaultdict(lambda: [0, 0, 0]), "counted": defaultdict(lambda: [0, 0, 0]), "talkers": Counter(),
+        "ingress": defaultdict(lambda: [0, 0, 0]), "egress_sources": set(), "local_az": {}, "peer_bytes": Counter(),
+        "records": 0, "skipped": 0, "undirected_files": 0
+    }
+    for result in results:
+        if result is None:
+            continue
+        for table in ("by_eni", "counted", "ingress"):
+            for key, (nbytes, packets, flows) in result[table].items():
+                entry = merged[table][key]
+                entry[0] += nbytes
+                entry[1] += packets
+                entry[2] += flows
+        merged["talkers"].update(result["talkers"])
+        merged["egress_sources"].update(result["egress_sources"])
+        merged["local_az"].update(result["local_az"])
+        merged["peer_bytes"].update(result["peer_bytes"])
+        for key in ("records", "skipped", "undirected_files"):
+            merged[key] += result[key]
+
+    # Ingress from a monitored ENI was already counted from the sender's egress record; ingress from
+    # anything else (internet, NAT'd downloads, on-prem) has no egress record and is counted here.
+    for (account, az, src), (nbytes, packets, flows) in merged["ingress"].items():
+        if src in merged["egress_sources"]:
+            continue
+        entry = merged["counted"][(account, az)]
+        entry[0] += nbytes
+        entry[1] += packets
+        entry[2] += flows
+        merged["talkers"][src] += nbytes
+    return merged
+
+
+def build_report(merged, tenants, top):
+    by_tenant = defaultdict(lambda: [0, 0, 0])
+    by_az = defaultdict(lambda: [0, 0, 0])
+    for (account, az), totals in merged["counted"].items():
+        for bucket in (by_tenant[tenants.get(account, account)], by_az[az]):
+            for i in range(3):
+                bucket[i] += totals[i]
+
+    cross_az = Counter()
+    for (az, peer), nbytes in merged["peer_bytes"].items():
+        peer_az = merged["local_az"].get(peer)
+        if peer_az and peer_az != az:
+            cross_az[f"{az} -> {peer_az}"] += nbytes
+
+    def rows(totals):
+        return [
+            {"key": k, "bytes": v[0], "packets": v[1], "flows": v[2]}
+            for k, v in sorted(totals.items(), key=lambda kv: kv[1][0], reverse=True)
+        ]
+
+    top_enis = sorted(merged["by_eni"].items(), key=lambda kv: kv[1][0], reverse=True)[:top]
+    if merged["undirected_files"]:
+        counted_from = (f"all records; {merged['undirected_files']} file(s) lack flow-direction, "
+                        "so flows between monitored ENIs count twice")
+    else:
+        counted_from = "egress records and ingress from unmonitored senders, each flow once"
+    return {
+        "records": merged["records"],
+        "skipped": merged["skipped"],
+        "counted_from": counted_from,
+        "by_tenant": rows(by_tenant),
+        "by_az": rows(by_az),
+        "top_enis": [
+            {"eni": eni, "az": az, "tenant": tenants.get(acct, acct), "bytes": v[0], "packets": v[1], "flows": v[2]}
+            for (acct, eni, az), v in top_enis
+        ],
+        "top_talkers": [{"address": a, "bytes": b} for a, b in merged["talkers"].most_common(top)],
+        "cross_az": [{"path": p, "bytes": b} for p, b in cross_az.most_common()],
+        "cross_az_bytes": sum(cross_az.values())
+    }
+
+
+def print_report(report):
+    print(f"\nRecords analysed: {report['records']} (skipped {report['skipped']})")
+    print(f"Tenant, AZ and talker totals count {report['counted_from']}; top ENIs count both directions.")
+    for title, key in (("Tenant", "by_tenant"), ("AZ", "by_az")):
+        print(f"\n{'Per ' + title:<40}{'Bytes':>18}{'Packets':>16}{'Flows':>12}")
+        for row in report[key]:
+            print(f"  {row['key']:<38}{row['bytes']:>18,}{row['packets']:>16,}{row['flows']:>12,}")
+
+    print(f"\n{'Top ENIs':<40}{'Bytes':>18}{'Packets':>16}{'Flows':>12}")
+    for row in report["top_enis"]:
+        label = f"{row['eni']} ({row['az']}, {row['tenant']})"
+        print(f"  {label:<38}{row['bytes']:>18,}{row['packets']:>16,}{row['flows']:>12,}")
+
+    print(f"\n{'Top talkers (source address)':<40}{'Bytes':>18}")
+    for row in report["top_talkers"]:
+        print(f"  {row['address']:<38}{row['bytes']:>18,}")
+
+    print(f"\n{'Cross-AZ traffic':<40}{'Bytes':>18}")
+    for row in report["cross_az"]:
+        print(f"  {row['path']:<38}{row['bytes']:>18,}")
+    print(f"  {'Total':<38}{report['cross_az_bytes']:>18,}")
+
+
+def load_tenants(manifest_path):
+    """Map account IDs to tenant names from the tenant manifest, if one is given."""
+    if not manifest_path:
+        return {}
+    with open(manifest_path, "r") as f:
+        return {t["account_id"]: t["name"] for t in json.load(f).get("tenants", [])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate VPC Flow Log files per ENI, AZ and tenant.")
+    parser.add_argument("paths", nargs="+", help="Flow log files or directories (e.g. a local 'aws s3 sync' copy).")
+    parser.add_argument("--manifest", help="Tenant manifest used to name accounts (perimeter parameters/tenant-manifest.json).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Files processed in parallel.")
+    parser.add_argument("--top", type=int, default=10, help="Number of top ENIs and talkers to report.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    files = find_log_files(args.paths)
+    if not files:
+        logger.error("No flow log files found.")
+        sys.exit(1)
+
+    logger.info(f"Analysing {len(files)} flow log file(s) with {args.workers} worker(s)...")
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        merged = merge_results(pool.map(analyze_file, files, chunksize=4))
+
+    report = build_report(merged, load_tenants(args.manifest), args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -6,8 +6,15 @@ import subprocess
 import argparse
 from botocore.exceptions import ClientError
 
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import change_sets
+import log_pipeline
+import preflight
+import service_registry
+
 # --- Logging setup ---
-logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+log_pipeline.setup_logging("deployment.log")
 logger = logging.getLogger(__name__)
 
 # --- AWS clients ---
@@ -16,12 +23,24 @@ ec2 = boto3.client('ec2')
 
 # --- Constants ---
 TEMPLATE_DIR = "templates"
+PERIMETER_PROJECT = "SecurityPerimeter"  # ProjectName of the perimeter deployment publishing the GWLB service
 
 # --- Argument parsing ---
 parser = argparse.ArgumentParser()
 parser.add_argument('--force', action='store_true', help='Force update stacks even if already completed.')
+parser.add_argument('--plan', action='store_true', help='Create change sets for all stacks and report them before executing.')
+parser.add_argument('--execute', action='store_true', help='With --plan, execute the change sets without prompting.')
+parser.add_argument('--skip-preflight', action='store_true', help='Skip validating AMIs, key pairs, AZs, instance types and CIDRs before deploying.')
+parser.add_argument('--registry', default='ssm', help="Where the perimeter publishes its outputs: 'ssm' or 'file:<path>'.")
+parser.add_argument('--registry-ttl', type=int, default=service_registry.DEFAULT_TTL, help='Seconds to cache registry lookups.')
+parser.add_argument('--refresh-registry', action='store_true', help='Ignore cached registry values (e.g. after a service rotation).')
+parser.add_argument('--registry-profile', help='AWS profile of the perimeter account, which owns the SSM registry (default: current credentials).')
+parser.add_argument('--service-name', help='GWLB endpoint service name to use instead of the registry value.')
 args = parser.parse_args()
 
+# Explicit values that take precedence over the registry, keyed by registry_key
+registry_overrides = {"GWLBServiceName": args.service_name}
+
 # --- Stack deployment definitions ---
 stack_definitions = [
     {
@@ -45,8 +64,10 @@ stack_definitions = [
         "name": "SEgwlbeStack",
         "template": "gwlb-endpoint.yaml",
         "parameters": [
-            {"ParameterKey": "ProjectName", "ParameterValue": "customer-egress"},
-            {"ParameterKey": "ServiceName", "ParameterValue": "com.amazonaws.vpce.ap-southeast-1.vpce-svc-0eaa5d68deb2856ba"}
+            {"ParameterKey": "ProjectName", "ParameterValue": "customer-egress"}
+        ],
+        "parameters_from_registry": [
+            {"registry_key": "GWLBServiceName", "parameter_key": "ServiceName"}
         ],
         "parameters_from_outputs": [
             {"output_key": "VpcId", "parameter_key": "VpcId"},
@@ -61,12 +82,7 @@ stack_definitions = [
         "name": "SEngwStack",
         "template": "ngw.yaml",
         "parameters": [
-            {"ParameterKey": "ProjectName", "ParameterValue": "customer-egress"},
-            {"ParameterKey": "VpcId", "ParameterValue": ""},  # To be filled from outputs
-            {
-                "ParameterKey": "PublicSubnetIds",
-                "ParameterValue": ""  # To be filled from outputs
-            }
+            {"ParameterKey": "ProjectName", "ParameterValue": "customer-egress"}
         ],
         "parameters_from_outputs": [
             {"output_key": "VpcId", "parameter_key": "VpcId"},
@@ -79,117 +95,23 @@ stack_definitions = [
     }
 ]
 
-def wait_for_completion(stack_name, operation):
-    """Wait for a CloudFormation stack operation to complete."""
-    waiter_name = 'stack_create_complete' if operation == 'create_stack' else 'stack_update_complete'
-    waiter = cf.get_waiter(waiter_name)
-    logger.info(f"Waiting for {stack_name} to {operation.replace('_', ' ')}...")
+def resolve_registry_parameter(stack_def, p):
+    """Return a parameters_from_registry value: the explicit override, or the perimeter's published output."""
+    value = registry_overrides.get(p["registry_key"])
+    if value:
+        return value
     try:
-        waiter.wait(StackName=stack_name)
-        logger.info(f"{stack_name} {operation.replace('_', ' ')} completed successfully.")
-    except Exception as e:
-        logger.error(f"Error during stack wait: {e}")
-        sys.exit(1)  # Exit if waiting fails
-
-def get_stack_status(stack_name):
-    """Retrieve the current status of a CloudFormation stack."""
-    try:
-        response = cf.describe_stacks(StackName=stack_name)
-        return response['Stacks'][0]['StackStatus']
-    except ClientError as e:
-        if 'does not exist' in str(e):
-            return None
-        logger.error(f"Failed to get status of stack {stack_name}: {e}")
+        return service_registry.resolve(
+            PERIMETER_PROJECT, p["registry_key"], source=args.registry, ttl=args.registry_ttl,
+            profile=args.registry_profile, refresh=args.refresh_registry
+        )
+    except (ClientError, OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to resolve '{p['registry_key']}' for stack {stack_def['name']}: {e}")
+        if not args.registry_profile and args.registry == "ssm":
+            logger.error("The registry is published in the perimeter account; pass --registry-profile "
+                         "for that account or --service-name explicitly.")
         return None
 
-def deploy_stack(stack_def, collected_outputs):
-    """Deploy a CloudFormation stack based on the provided definition."""
-    stack_name = stack_def["name"]
-    template_path = os.path.join(TEMPLATE_DIR, stack_def["template"])
-
-    if not os.path.isfile(template_path):
-        logger.error(f"Template file not found: {template_path}")
-        return False
-
-    with open(template_path, 'r') as f:
-        template_body = f.read()
-
-    try:
-        cf.validate_template(TemplateBody=template_body)
-    except ClientError as e:
-        logger.error(f"Template validation failed: {e}")
-        return False
-
-    parameters = list(stack_def.get("parameters", []))
-
-    for p in stack_def.get("parameters_from_outputs", []):
-        if "output_key" in p:
-            key = p["output_key"]
-            if key not in collected_outputs:
-                logger.error(f"Missing required output '{key}' for stack {stack_name}")
-                return False
-            parameters.append({
-                "ParameterKey": p["parameter_key"],
-                "ParameterValue": collected_outputs[key]
-            })
-        elif "output_keys" in p:
-            values = [collected_outputs.get(k) for k in p["output_keys"]]
-            if None in values:
-                missing = [k for k in p["output_keys"] if collected_outputs.get(k) is None]
-                logger.error(f"Missing required output(s) {', '.join(missing)} for stack {stack_name}")
-                return False
-            parameters.append({
-                "ParameterKey": p["parameter_key"],
-                "ParameterValue": ",".join(values)
-            })
-        else:
-            logger.error(f"Invalid parameter mapping in stack {stack_name}: {p}")
-            return False
-
-    stack_status = get_stack_status(stack_name)
-    try:
-        if not stack_status:
-            response = cf.create_stack(
-                StackName=stack_name,
-                TemplateBody=template_body,
-                Parameters=parameters,
-                Capabilities=['CAPABILITY_NAMED_IAM'],
-                DisableRollback=True
-            )
-            logger.info(f"Creating stack: {response['StackId']}")
-            wait_for_completion(stack_name, 'create_stack')
-        elif stack_status in ["CREATE_COMPLETE", "UPDATE_COMPLETE"]:
-            if not args.force:
-                logger.info(f"Stack {stack_name} already exists. Skipping (use --force to override).")
-                return True
-            cf.update_stack(
-                StackName=stack_name,
-                TemplateBody=template_body,
-                Parameters=parameters,
-                Capabilities=['CAPABILITY_NAMED_IAM']
-            )
-            logger.info(f"Updating stack {stack_name}")
-            wait_for_completion(stack_name, 'update_stack')
-        else:
-            logger.error(f"Stack {stack_name} is in unexpected state: {stack_status}")
-            return False
-        return True
-    except ClientError as e:
-        if "No updates are to be performed" in str(e):
-            logger.info(f"No updates needed for stack {stack_name}.")
-            return True
-        logger.error(f"Error deploying stack {stack_name}: {e}")
-        return False
-
-def get_stack_outputs(stack_name):
-    """Retrieve the outputs of a CloudFormation stack."""
-    try:
-        response = cf.describe_stacks(StackName=stack_name)
-        return {o['OutputKey']: o['OutputValue'] for o in response['Stacks'][0].get('Outputs', [])}
-    except ClientError as e:
-        logger.error(f"Failed to get outputs for {stack_name}: {e}")
-        return {}
-
 def set_vpc_dns_attributes(vpc_id):
     """Enable DNS support and hostnames for the specified VPC."""
     try:
@@ -200,45 +122,48 @@ def set_vpc_dns_attributes(vpc_id):
         logger.error(f"Failed to modify VPC DNS attributes: {e}")
         sys.exit(1)
 
-if __name__ == "__main__":
-    collected_outputs = {}
+def derive_outputs(stack_def, collected_outputs):
+    """Build joined outputs and apply VPC settings once SEvpcStack is deployed."""
+    if stack_def["name"] != "SEvpcStack":
+        return
+
+    # Build GWLBSubnetIds
+    gwlb_required = ["GWLBSubnet1Id", "GWLBSubnet2Id", "GWLBSubnet3Id"]
+    if all(k in collected_outputs for k in gwlb_required):
+        collected_outputs["GWLBSubnetIds"] = ",".join(collected_outputs[k] for k in gwlb_required)
+    else:
+        missing = [k for k in gwlb_required if k not in collected_outputs]
+        logger.error(f"Missing GWLB subnet IDs: {', '.join(missing)}")
+        sys.exit(1)
 
-    for stack in stack_definitions:
-        success = deploy_stack(stack, collected_outputs)
-        if not success:
-            logger.error("Aborting pipeline due to failed stack.")
+    # Collect Public Subnet IDs
+    public_subnet_required = ["PublicSubnet1Id", "PublicSubnet2Id", "PublicSubnet3Id"]
+    if all(k in collected_outputs for k in public_subnet_required):
+        collected_outputs["PublicSubnetIds"] = ",".join(collected_outputs[k] for k in public_subnet_required)
+    else:
+        missing = [k for k in public_subnet_required if k not in collected_outputs]
+        logger.error(f"Missing public subnet IDs: {', '.join(missing)}")
+        sys.exit(1)
+
+    # Enable DNS attributes
+    set_vpc_dns_attributes(collected_outputs["VpcId"])
+
+    logger.info("\n--- Derived Outputs after SEvpcStack ---")
+    logger.info(f"GWLBSubnetIds: {collected_outputs['GWLBSubnetIds']}")
+    logger.info(f"PublicSubnetIds: {collected_outputs['PublicSubnetIds']}")
+
+pipeline = change_sets.Pipeline(
+    cf, stack_definitions, template_dir=TEMPLATE_DIR,
+    parameter_sources={"parameters_from_registry": resolve_registry_parameter},
+    after_stack=derive_outputs, tag_tenant=True, force=args.force, execute=args.execute
+)
+
+if __name__ == "__main__":
+    if not args.skip_preflight:
+        _, known_outputs = pipeline.get_known_outputs()
+        if not preflight.run(ec2, stack_definitions, known_outputs):
+            logger.error("Aborting: pre-flight validation failed, no stack was submitted.")
             sys.exit(1)
 
-        outputs = get_stack_outputs(stack["name"])
-        for key in stack.get("outputs", []):
-            if key in outputs:
-                collected_outputs[key] = outputs[key]
-            else:
-                logger.warning(f"Output '{key}' not found in {stack['name']}")
-
-        # === DERIVED OUTPUTS after SEvpcStack ===
-        if stack["name"] == "SEvpcStack":
-            # Build GWLBSubnetIds
-            gwlb_required = ["GWLBSubnet1Id", "GWLBSubnet2Id", "GWLBSubnet3Id"]
-            if all(k in collected_outputs for k in gwlb_required):
-                collected_outputs["GWLBSubnetIds"] = ",".join(collected_outputs[k] for k in gwlb_required)
-            else:
-                missing = [k for k in gwlb_required if k not in collected_outputs]
-                logger.error(f"Missing GWLB subnet IDs: {', '.join(missing)}")
-                sys.exit(1)
-
-            # Collect Public Subnet IDs
-            public_subnet_required = ["PublicSubnet1Id", "PublicSubnet2Id", "PublicSubnet3Id"]
-            if all(k in collected_outputs for k in public_subnet_required):
-                collected_outputs["PublicSubnetIds"] = ",".join(collected_outputs[k] for k in public_subnet_required)
-            else:
-                missing = [k for k in public_subnet_required if k not in collected_outputs]
-                logger.error(f"Missing public subnet IDs: {', '.join(missing)}")
-                sys.exit(1)
-
-            # Enable DNS attributes
-            set_vpc_dns_attributes(collected_outputs["VpcId"])
-
-            logger.info("\n--- Derived Outputs after SEvpcStack ---")
-            logger.info(f"GWLBSubnetIds: {collected_outputs['GWLBSubnetIds']}")
-            logger.info(f"PublicSubnetIds: {collected_outputs['PublicSubnetIds']}")
+    ok, _ = pipeline.run(plan=args.plan)
+    sys.exit(0 if ok else 1)
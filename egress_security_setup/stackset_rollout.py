@@ -0,0 +1,385 @@
+import boto3
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import log_pipeline
+import service_registry
+
+# --- Logging setup ---
+log_pipeline.setup_logging("stackset-rollout.log")
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+TEMPLATE_DIR = "templates"
+TENANT_MANIFEST = os.path.join("..", "perimeter_security_setup", "parameters", "tenant-manifest.json")
+PERIMETER_PROJECT = "SecurityPerimeter"  # ProjectName of the perimeter deployment publishing the GWLB service
+FINAL_STATUSES = ("SUCCEEDED", "FAILED", "STOPPED")
+FAILED_RESULTS = ("FAILED", "CANCELLED")
+AZ_COUNT = 3  # The egress templates create one subnet per AZ for three AZs
+MAX_WORKERS = 8
+OVERRIDES_CACHE = ".stackset-overrides-cache.json"  # (stack set, account, region) -> overrides as of LastOperationId
+
+# --- Argument parsing ---
+parser = argparse.ArgumentParser(description="Roll the egress VPC, GWLBe and NGW stacks out to tenant accounts with StackSets.")
+parser.add_argument('--manifest', default=TENANT_MANIFEST, help='Tenant manifest with account IDs, optional regions and parameter overrides.')
+parser.add_argument('--regions', default="ap-southeast-1", help='Comma-separated default regions for tenants without "regions".')
+parser.add_argument('--name-prefix', default="customer-egress", help='Prefix of the stack set names.')
+parser.add_argument('--permission-model', choices=["SELF_MANAGED", "SERVICE_MANAGED"], default="SELF_MANAGED")
+parser.add_argument('--ou-id', action='append', dest='ou_ids', help='Organizational unit containing the tenant accounts (SERVICE_MANAGED).')
+parser.add_argument('--max-concurrent-percentage', type=int, default=25, help='Percentage of accounts deployed at the same time per region.')
+parser.add_argument('--failure-tolerance-percentage', type=int, default=10, help='Percentage of failed accounts per region before the operation stops.')
+parser.add_argument('--region-concurrency', choices=["SEQUENTIAL", "PARALLEL"], default="PARALLEL",
+                    help='How the regions of one operation roll out; operations span regions when their overrides match.')
+parser.add_argument('--registry', default='ssm', help="Where the perimeter publishes its outputs: 'ssm' or 'file:<path>'.")
+parser.add_argument('--registry-profile', help='AWS profile of the perimeter account, which owns the SSM registry (default: current credentials).')
+parser.add_argument('--poll-interval', type=int, default=15, help='Seconds between operation status polls.')
+parser.add_argument('--dry-run', action='store_true', help='Report the operations that would be started without starting them.')
+args = parser.parse_args()
+
+if args.permission_model == "SERVICE_MANAGED" and not args.ou_ids:
+    parser.error("--ou-id is required with --permission-model SERVICE_MANAGED")
+
+# --- AWS clients ---
+cf = boto3.client('cloudformation')
+
+# --- Stack set definitions ---
+# Each stage starts after the previous one finished; the stack sets of one stage roll out together.
+# Parameters are shared by all instances; overrides come from the region and the tenant manifest.
+stack_set_definitions = [
+    {
+        "name": "vpc",
+        "template": "vpc.yaml",
+        "stage": 0,
+        "parameters": [
+            {"ParameterKey": "ProjectName", "ParameterValue": "customer-egress"},
+            {"ParameterKey": "VpcCidr", "ParameterValue": "10.100.0.0/16"},
+            {"ParameterKey": "AvailabilityZones", "ParameterValue": ""},  # Overridden per region (or per tenant)
+            {"ParameterKey": "PublicSubnetCidrs", "ParameterValue": "10.100.0.0/24,10.100.1.0/24,10.100.2.0/24"},
+            {"ParameterKey": "PrivateSubnetCidrs", "ParameterValue": "10.100.10.0/24,10.100.11.0/24,10.100.12.0/24"},
+            {"ParameterKey": "TGWSubnetCidrs", "ParameterValue": "10.100.20.0/24,10.100.21.0/24,10.100.22.0/24"},
+            {"ParameterKey": "GWLBSubnetCidrs", "ParameterValue": "10.100.30.0/24,10.100.31.0/24,10.100.32.0/24"}
+        ]
+    },
+    {
+        "name": "gwlbe",
+        "template": "stackset-gwlb-endpoint.yaml",
+        "stage": 1,
+        "parameters": [
+            {"ParameterKey": "ProjectName", "ParameterValue": "customer-egress"},
+            {"ParameterKey": "ServiceName", "ParameterValue": ""}  # Overridden per region from the service registry
+        ]
+    },
+    {
+        "name": "ngw",
+        "template": "stackset-ngw.yaml",
+        "stage": 1,
+        "parameters": [
+            {"ParameterKey": "ProjectName", "ParameterValue": "customer-egress"}
+        ]
+    }
+]
+
+def stack_set_name(stack_set_def):
+    return f"{args.name_prefix}-{stack_set_def['name']}"
+
+def read_template(stack_set_def):
+    with open(os.path.join(TEMPLATE_DIR, stack_set_def["template"]), 'r') as f:
+        return f.read()
+
+def load_targets(manifest_path):
+    """Return {(account, region): tenant} from the tenant manifest."""
+    default_regions = [r.strip() for r in args.regions.split(",") if r.strip()]
+    with open(manifest_path, 'r') as f:
+        tenants = json.load(f).get("tenants", [])
+    return {(t["account_id"], region): t for t in tenants for region in t.get("regions", default_regions)}
+
+_region_azs = {}  # region -> comma-separated AZ names
+
+def region_azs(region):
+    """Return the first AZ_COUNT available AZs of a region; zone letters are not contiguous everywhere."""
+    if region not in _region_azs:
+        zones = boto3.client('ec2', region_name=region).describe_availability_zones(
+            Filters=[{"Name": "state", "Values": ["available"]}, {"Name": "zone-type", "Values": ["availability-zone"]}]
+        )["AvailabilityZones"]
+        names = sorted(z["ZoneName"] for z in zones if z.get("OptInStatus") != "not-opted-in")
+        if len(names) < AZ_COUNT:
+            raise ValueError(f"{region} has {len(names)} available AZ(s), {AZ_COUNT} are required")
+        _region_azs[region] = ",".join(names[:AZ_COUNT])
+    return _region_azs[region]
+
+def region_overrides(stack_set_def, region):
+    """Parameters that differ per region: the AZ names and the regional GWLB endpoint service."""
+    keys = {p["ParameterKey"] for p in stack_set_def["parameters"]}
+    overrides = {}
+    if "AvailabilityZones" in keys:
+        overrides["AvailabilityZones"] = region_azs(region)
+    if "ServiceName" in keys:
+        overrides["ServiceName"] = service_registry.resolve(PERIMETER_PROJECT, "GWLBServiceName", source=args.registry,
+                                                            region=region, profile=args.registry_profile)
+    return overrides
+
+def instance_overrides(stack_set_def, tenant, region):
+    """Region overrides plus the tenant's manifest "parameters" that this stack set accepts."""
+    keys = {p["ParameterKey"] for p in stack_set_def["parameters"]}
+    overrides = region_overrides(stack_set_def, region)
+    overrides.update({k: v for k, v in tenant.get("parameters", {}).items() if k in keys})
+    return overrides
+
+def group_targets(stack_set_def, targets):
+    """Group (account, region) targets into operations, each covering all of its accounts in all of its regions.
+
+    Accounts share an operation when they deploy to the same regions with the same overrides, so stack sets
+    without region-specific overrides (e.g. NGW) roll out every region in one operation under --region-concurrency.
+    """
+    regions_by_overrides = defaultdict(lambda: defaultdict(set))  # overrides -> account -> regions
+    for (account, region), tenant in targets.items():
+        overrides = tuple(sorted(instance_overrides(stack_set_def, tenant, region).items()))
+        regions_by_overrides[overrides][account].add(region)
+    groups = defaultdict(list)
+    for overrides, regions_by_account in regions_by_overrides.items():
+        for account, regions in regions_by_account.items():
+            groups[(overrides, tuple(sorted(regions)))].append(account)
+    return [
+        {"accounts": sorted(accounts), "regions": list(regions), "overrides": dict(overrides)}
+        for (overrides, regions), accounts in groups.items()
+    ]
+
+def operation_preferences():
+    return {
+        "RegionConcurrencyType": args.region_concurrency,
+        "MaxConcurrentPercentage": args.max_concurrent_percentage,
+        "FailureTolerancePercentage": args.failure_tolerance_percentage
+    }
+
+def deployment_targets(accounts):
+    if args.permission_model == "SERVICE_MANAGED":
+        return {"OrganizationalUnitIds": args.ou_ids, "Accounts": accounts, "AccountFilterType": "INTERSECTION"}
+    return {"Accounts": accounts}
+
+# --- Stack set operations ---
+def ensure_stack_set(stack_set_def):
+    """Create the stack set, or update it when the template or parameters changed.
+
+    Returns the update operation ID, if an update was started.
+    """
+    name = stack_set_name(stack_set_def)
+    template_body = read_template(stack_set_def)
+    try:
+        current = cf.describe_stack_set(StackSetName=name)['StackSet']
+    except ClientError as e:
+        if 'StackSetNotFound' not in str(e):
+            raise
+        current = None
+
+    if current is None:
+        logger.info(f"Creating stack set {name}")
+        if args.dry_run:
+            return None
+        kwargs = {}
+        if args.permission_model == "SERVICE_MANAGED":
+            kwargs["AutoDeployment"] = {"Enabled": False}
+        cf.create_stack_set(
+            StackSetName=name,
+            TemplateBody=template_body,
+            Parameters=stack_set_def["parameters"],
+            Capabilities=['CAPABILITY_NAMED_IAM'],
+            PermissionModel=args.permission_model,
+            ManagedExecution={"Active": True},  # Queue non-conflicting operations instead of rejecting them
+            **kwargs
+        )
+        return None
+
+    actual = {p['ParameterKey']: p.get('ParameterValue') for p in current.get('Parameters', [])}
+    desired = {p['ParameterKey']: p['ParameterValue'] for p in stack_set_def["parameters"]}
+    if current.get('TemplateBody') == template_body and actual == desired:
+        return None
+
+    logger.info(f"Updating stack set {name} and all of its instances")
+    if args.dry_run:
+        return None
+    response = cf.update_stack_set(
+        StackSetName=name,
+        TemplateBody=template_body,
+        Parameters=stack_set_def["parameters"],
+        Capabilities=['CAPABILITY_NAMED_IAM'],
+        OperationPreferences=operation_preferences(),
+        ManagedExecution={"Active": True}
+    )
+    return response['OperationId']
+
+def list_instances(name):
+    """Return {(account, region): summary} of the existing stack instances."""
+    instances = {}
+    try:
+        for page in cf.get_paginator('list_stack_instances').paginate(StackSetName=name):
+            for summary in page.get('Summaries', []):
+                instances[(summary['Account'], summary['Region'])] = summary
+    except ClientError as e:
+        if 'StackSetNotFound' not in str(e):
+            raise
+    return instances
+
+def _read_overrides_cache():
+    if not os.path.isfile(OVERRIDES_CACHE):
+        return {}
+    try:
+        with open(OVERRIDES_CACHE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_overrides_cache(cache):
+    tmp_path = f"{OVERRIDES_CACHE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=4)
+    os.replace(tmp_path, OVERRIDES_CACHE)
+
+def instance_parameter_overrides(name, instances, targets):
+    """Return {(account, region): overrides} of existing stack instances.
+
+    Overrides only change through an operation, so an instance whose LastOperationId (from ListStackInstances)
+    matches the cached one reuses the cached overrides; the others are described concurrently.
+    """
+    def describe(target):
+        account, region = target
+        instance = cf.describe_stack_instance(
+            StackSetName=name, StackInstanceAccount=account, StackInstanceRegion=region
+        )['StackInstance']
+        return {p['ParameterKey']: p['ParameterValue'] for p in instance.get('ParameterOverrides', [])}
+
+    cache = _read_overrides_cache()
+    overrides, stale = {}, []
+    for target in targets:
+        entry = cache.get("|".join((name,) + target))
+        operation_id = instances[target].get('LastOperationId')
+        if entry and operation_id and entry["operation"] == operation_id:
+            overrides[target] = entry["overrides"]
+        else:
+            stale.append(target)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(stale))) as pool:
+            described = dict(zip(stale, pool.map(describe, stale)))
+        for target, actual in described.items():
+            operation_id = instances[target].get('LastOperationId')
+            if operation_id:
+                cache["|".join((name,) + target)] = {"operation": operation_id, "overrides": actual}
+        overrides.update(described)
+        try:
+            _write_overrides_cache(cache)
+        except OSError as e:
+            logger.warning(f"Could not write {OVERRIDES_CACHE}: {e}")
+        logger.info(f"{name}: described {len(stale)} instance(s), {len(targets) - len(stale)} unchanged since the last run")
+    return overrides
+
+def start_stage(stack_set_defs, targets):
+    """Submit every operation of one stage and return them for tracking."""
+    operations = []
+    for stack_set_def in stack_set_defs:
+        name = stack_set_name(stack_set_def)
+        update_id = ensure_stack_set(stack_set_def)
+        if update_id:
+            operations.append({"stack_set": name, "id": update_id, "action": "update stack set"})
+
+        instances = list_instances(name)
+        missing = {t: tenant for t, tenant in targets.items() if t not in instances}
+        # An updated stack set already re-deploys its outdated instances
+        outdated = {} if update_id else {
+            t: tenant for t, tenant in targets.items() if t in instances and instances[t]['Status'] == "OUTDATED"
+        }
+        # CURRENT instances still need an update when their overrides changed, e.g. a rotated GWLB service
+        existing = [t for t in targets if t in instances and t not in outdated]
+        for (account, region), actual in instance_parameter_overrides(name, instances, existing).items():
+            if actual != instance_overrides(stack_set_def, targets[(account, region)], region):
+                outdated[(account, region)] = targets[(account, region)]
+
+        for action, selected in (("create", missing), ("update", outdated)):
+            for group in group_targets(stack_set_def, selected):
+                logger.info(f"{name}: {action} {len(group['accounts'])} account(s) in {', '.join(group['regions'])}")
+                if args.dry_run:
+                    continue
+                call = cf.create_stack_instances if action == "create" else cf.update_stack_instances
+                response = call(
+                    StackSetName=name,
+                    DeploymentTargets=deployment_targets(group["accounts"]),
+                    Regions=group["regions"],
+                    ParameterOverrides=[{"ParameterKey": k, "ParameterValue": v} for k, v in group["overrides"].items()],
+                    OperationPreferences=operation_preferences()
+                )
+                operations.append({"stack_set": name, "id": response['OperationId'], "action": f"{action} instances"})
+    return operations
+
+def track_operations(operations, tenants_by_account):
+    """Poll all operations from one loop until they finish; return the (account, region) targets that failed."""
+    pending = {op["id"]: op for op in operations}
+    reported = set()
+    last_progress = {}
+    failed = set()
+
+    while pending:
+        for op_id, op in list(pending.items()):
+            status = cf.describe_stack_set_operation(
+                StackSetName=op["stack_set"], OperationId=op_id
+            )['StackSetOperation']['Status']
+
+            counts = Counter()
+            paginator = cf.get_paginator('list_stack_set_operation_results')
+            for page in paginator.paginate(StackSetName=op["stack_set"], OperationId=op_id):
+                for result in page.get('Summaries', []):
+                    counts[result['Status']] += 1
+                    target = (result['Account'], result['Region'])
+                    if result['Status'] in FAILED_RESULTS and (op_id, target) not in reported:
+                        reported.add((op_id, target))
+                        failed.add(target)
+                        log = log_pipeline.context_logger(
+                            logger, tenant=tenants_by_account.get(result['Account']), stack=op["stack_set"], phase="rollout"
+                        )
+                        log.error(f"{result['Account']}/{result['Region']}: {result['Status']} "
+                                  f"{result.get('StatusReason', '')}".rstrip())
+
+            progress = (status, tuple(sorted(counts.items())))
+            if progress != last_progress.get(op_id):
+                last_progress[op_id] = progress
+                summary = ", ".join(f"{n} {s.lower()}" for s, n in sorted(counts.items())) or "no results yet"
+                logger.info(f"{op['stack_set']} ({op['action']}): {status} - {summary}")
+            if status in FINAL_STATUSES:
+                del pending[op_id]
+
+        if pending:
+            time.sleep(args.poll_interval)
+    return failed
+
+if __name__ == "__main__":
+    targets = load_targets(args.manifest)
+    if not targets:
+        logger.error(f"No tenant accounts in {args.manifest}")
+        sys.exit(1)
+    tenants_by_account = {account: tenant["name"] for (account, _), tenant in targets.items()}
+    logger.info(f"Rolling out to {len(tenants_by_account)} account(s), {len(targets)} account/region target(s)")
+
+    all_failed = set()
+    for stage in sorted({d["stage"] for d in stack_set_definitions}):
+        stage_defs = [d for d in stack_set_definitions if d["stage"] == stage]
+        try:
+            operations = start_stage(stage_defs, targets)
+        except (ClientError, KeyError, OSError, ValueError) as e:
+            logger.error(f"Failed to start stage {stage}: {e}")
+            sys.exit(1)
+        failed = track_operations(operations, tenants_by_account)
+        if failed:
+            # Later stages import this stage's exports, so they skip the targets that failed here
+            logger.warning(f"Stage {stage}: {len(failed)} target(s) failed and are skipped by later stages")
+            targets = {t: tenant for t, tenant in targets.items() if t not in failed}
+            all_failed |= failed
+
+    logger.info(f"--- Rollout finished: {len(targets)} target(s) succeeded, {len(all_failed)} failed ---")
+    sys.exit(1 if all_failed else 0)
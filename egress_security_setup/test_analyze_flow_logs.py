@@ -0,0 +1,63 @@
+import gzip
+
+import analyze_flow_logs as afl
+
+HEADER = ("version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes "
+          "start end action log-status az-id flow-direction")
+
+
+def write_log(path, lines, header=HEADER):
+    with gzip.open(path, "wt") as f:
+        if header:
+            f.write(header + "\n")
+        f.writelines(line + "\n" for line in lines)
+    return str(path)
+
+
+def record(account, eni, src, dst, packets, nbytes, az, direction):
+    return f"5 {account} {eni} {src} {dst} 443 50000 6 {packets} {nbytes} 0 60 ACCEPT OK {az} {direction}"
+
+
+def report(paths, top=10):
+    return afl.build_report(afl.merge_results(afl.analyze_file(p) for p in paths), {"111": "tenant-a"}, top)
+
+
+def test_flow_between_monitored_enis_counts_once(tmp_path):
+    # 10.0.1.10 (az1) sends 1000 bytes to 10.0.2.20 (az2); the pair lands in two files
+    paths = [
+        write_log(tmp_path / "a.log.gz", [record("111", "eni-a", "10.0.1.10", "10.0.2.20", 10, 1000, "az1", "egress")]),
+        write_log(tmp_path / "b.log.gz", [record("111", "eni-b", "10.0.1.10", "10.0.2.20", 10, 1000, "az2", "ingress")]),
+    ]
+    result = report(paths)
+    assert result["by_tenant"] == [{"key": "tenant-a", "bytes": 1000, "packets": 10, "flows": 1}]
+    assert result["top_talkers"] == [{"address": "10.0.1.10", "bytes": 1000}]
+    assert sum(row["bytes"] for row in result["top_enis"]) == 2000
+
+
+def test_ingress_from_unmonitored_sender_is_counted(tmp_path):
+    path = write_log(tmp_path / "a.log.gz", [
+        record("111", "eni-a", "10.0.1.10", "93.184.216.34", 2, 200, "az1", "egress"),
+        record("111", "eni-a", "93.184.216.34", "10.0.1.10", 50, 50000, "az1", "ingress"),
+    ])
+    result = report([path])
+    assert result["by_az"] == [{"key": "az1", "bytes": 50200, "packets": 52, "flows": 2}]
+    assert result["top_talkers"][0] == {"address": "93.184.216.34", "bytes": 50000}
+
+
+def test_file_without_flow_direction_counts_every_record(tmp_path):
+    lines = [record("111", "eni-a", "10.0.1.10", "10.0.2.20", 10, 1000, "az1", "egress").rsplit(" ", 2)[0]] * 2
+    path = write_log(tmp_path / "default.log.gz", lines, header=None)
+    result = report([path])
+    assert result["by_tenant"] == [{"key": "tenant-a", "bytes": 2000, "packets": 20, "flows": 2}]
+    assert result["counted_from"].startswith("all records; 1 file(s)")
+
+
+def test_malformed_and_nodata_rows_are_skipped(tmp_path):
+    path = write_log(tmp_path / "a.log.gz", [
+        record("111", "eni-a", "10.0.1.10", "10.0.2.20", "ten", 1000, "az1", "egress"),
+        "5 111 eni-a - - - - - - - 0 60 - NODATA az1 -",
+        record("111", "eni-a", "10.0.1.10", "10.0.2.20", 1, 100, "az1", "egress"),
+    ])
+    result = report([path])
+    assert (result["records"], result["skipped"]) == (1, 2)
+    assert result["by_tenant"][0]["bytes"] == 100
@@ -0,0 +1,86 @@
+import json
+import ipaddress
+
+import verify_route_topology as vrt
+
+AZS = ["ap-southeast-1a", "ap-southeast-1b", "ap-southeast-1c"]
+DEFAULT_ROUTE = ipaddress.ip_network("0.0.0.0/0")
+
+
+def build_topology(project, subnet_format, vpc_id="vpc-1"):
+    """Hand-built topology of one VPC: private and tgw subnets with their own route table per AZ
+    routed to the AZ's GWLBe, and gwlb subnets (holding the endpoints) routed to a NAT gateway."""
+    topology = {"subnets": {}, "subnet_tables": {}, "main_tables": {}, "tables": {}, "hops": {}}
+    for i, az in enumerate(AZS, start=1):
+        topology["hops"][f"vpce-{i}"] = {"subnet": f"subnet-gwlb-{i}", "service": "com.amazonaws.vpce.svc-1"}
+        topology["hops"][f"nat-{i}"] = {"subnet": f"subnet-public-{i}"}
+        for role, target in (("private", f"vpce-{i}"), ("tgw", f"vpce-{i}"), ("gwlb", f"nat-{i}"), ("public", "igw-1")):
+            subnet_id, table_id = f"subnet-{role}-{i}", f"rtb-{role}-{i}"
+            name = subnet_format.format(project=project, role=role, i=i)
+            topology["subnets"][subnet_id] = {"vpc": vpc_id, "az": az, "name": name,
+                                              "role": vrt.SUBNET_ROLE_PATTERN.search(name).group(1)}
+            topology["subnet_tables"][subnet_id] = table_id
+            route = {"DestinationCidrBlock": "0.0.0.0/0", "State": "active"}
+            route["VpcEndpointId" if target.startswith("vpce-") else "NatGatewayId" if target.startswith("nat-")
+                  else "GatewayId"] = target
+            topology["tables"][table_id] = {"RouteTableId": table_id, "VpcId": vpc_id, "Routes": [route]}
+    return topology
+
+
+def set_default_route(topology, table_id, **target):
+    topology["tables"][table_id]["Routes"] = [{"DestinationCidrBlock": "0.0.0.0/0", "State": "active", **target}]
+
+
+def test_subnet_role_pattern_matches_egress_and_perimeter_names():
+    assert vrt.SUBNET_ROLE_PATTERN.search("customer-egress-private-subnet-az1").group(1) == "private"
+    assert vrt.SUBNET_ROLE_PATTERN.search("SecurityPerimeter-tgw-az1").group(1) == "tgw"
+    assert vrt.SUBNET_ROLE_PATTERN.search("SecurityPerimeter-security-az3").group(1) == "security"
+
+
+def test_trace_path_follows_gwlbe_and_nat_in_the_same_az():
+    topology = build_topology("customer-egress", "{project}-{role}-subnet-az{i}")
+    hops, terminal, problem = vrt.trace_path(topology, "subnet-private-2", DEFAULT_ROUTE)
+    assert problem is None
+    assert terminal == "igw-1"
+    assert [(h["target"], h["az"]) for h in hops] == [
+        ("vpce-2", "ap-southeast-1b"), ("nat-2", "ap-southeast-1b")
+    ]
+
+
+def test_verify_accepts_az_affine_topology():
+    topology = build_topology("customer-egress", "{project}-{role}-subnet-az{i}")
+    findings, corrections = vrt.verify(topology, DEFAULT_ROUTE, {"private", "tgw"})
+    assert findings == []
+    assert corrections == []
+
+
+def test_verify_flags_cross_az_hop_and_proposes_same_az_endpoint():
+    topology = build_topology("customer-egress", "{project}-{role}-subnet-az{i}")
+    set_default_route(topology, "rtb-private-2", VpcEndpointId="vpce-1")
+    findings, corrections = vrt.verify(topology, DEFAULT_ROUTE, {"private", "tgw"})
+    assert [f["subnet"] for f in findings] == ["customer-egress-private-subnet-az2"]
+    assert corrections == [{"RouteTableId": "rtb-private-2", "DestinationCidrBlock": "0.0.0.0/0",
+                            "current": "vpce-1", "proposed": "vpce-2"}]
+
+
+def test_verify_flags_skipped_inspection_with_perimeter_names():
+    topology = build_topology("SecurityPerimeter", "{project}-{role}-az{i}")
+    set_default_route(topology, "rtb-tgw-3", NatGatewayId="nat-3")
+    findings, corrections = vrt.verify(topology, DEFAULT_ROUTE, {"private", "tgw"})
+    assert [(f["subnet"], f["issue"]) for f in findings] == [("SecurityPerimeter-tgw-az3", "skips GWLB inspection")]
+    assert corrections == [{"RouteTableId": "rtb-tgw-3", "DestinationCidrBlock": "0.0.0.0/0",
+                            "current": "nat-3", "proposed": "vpce-3"}]
+
+
+def test_write_route_parameters_emits_one_file_per_role(tmp_path):
+    topology = build_topology("customer-egress", "{project}-{role}-subnet-az{i}")
+    paths = vrt.write_route_parameters(topology, DEFAULT_ROUTE, {"private", "tgw"}, str(tmp_path))
+    assert sorted(p.rsplit("/", 1)[-1] for p in paths) == [
+        "vpc-1-private-gwlbe-routes-parameters.json", "vpc-1-tgw-gwlbe-routes-parameters.json"
+    ]
+    for role in ("private", "tgw"):
+        with open(tmp_path / f"vpc-1-{role}-gwlbe-routes-parameters.json") as f:
+            parameters = {p["ParameterKey"]: p["ParameterValue"] for p in json.load(f)}
+        for i in (1, 2, 3):
+            assert parameters[f"RouteTableIdAZ{i}"] == f"rtb-{role}-{i}"
+            assert parameters[f"GWLBeEndpointIdAZ{i}"] == f"vpce-{i}"
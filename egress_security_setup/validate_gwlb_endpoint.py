@@ -1,52 +1,355 @@
+import argparse
+import os
+import sys
+import sqlite3
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
+from botocore.exceptions import ClientError, BotoCoreError
 
 # -------- Configuration --------
 region = "ap-southeast-1"
 spoke_vpc_id = None  # Set your spoke VPC ID, or leave None to check all VPCs
+gwlb_stack_name = "GWLBStack"  # Perimeter stack exporting GWLBTargetGroupArn / GWLBArn
+asg_stack_name = "AutoScalingGroupStack"  # Perimeter stack exporting AutoScalingGroupName
+
+# -------- Argument parsing --------
+parser = argparse.ArgumentParser(description="Validate the GWLBe -> GWLB -> appliance inspection path per AZ.")
+parser.add_argument('--region', default=region, help='Region of the spoke and perimeter VPCs.')
+parser.add_argument('--vpc-id', default=spoke_vpc_id, help='Spoke VPC ID (default: all VPCs).')
+parser.add_argument('--service-name', help='GWLB endpoint service name (default: read from the GWLB stack outputs).')
+parser.add_argument('--target-group-arn', help='GWLB target group ARN (default: read from the GWLB stack outputs).')
+parser.add_argument('--asg-name', help='Appliance Auto Scaling group (default: read from the ASG stack outputs).')
+parser.add_argument('--perimeter-profile', help='AWS profile for the perimeter account (default: current credentials).')
+parser.add_argument('--manifest', help='Tenant manifest: probe every tenant, using each tenant\'s "profile" for its endpoints.')
+parser.add_argument('--inventory', metavar='DB', help='Read endpoints, connections and target health from an inventory.py '
+                    'database; the GWLB zones and ASG lifecycle states are still read live.')
+parser.add_argument('--interval', type=int, default=0, help='Re-run the probe every N seconds (default: run once).')
+args = parser.parse_args()
+
+# -------- Initialize Boto3 Clients --------
+# Spoke-side lookups use the current credentials (or each tenant's profile with --manifest),
+# perimeter-side lookups use the perimeter profile when the GWLB lives in a different account.
+ec2 = boto3.client("ec2", region_name=args.region)
+perimeter = boto3.Session(profile_name=args.perimeter_profile, region_name=args.region)
+perimeter_ec2 = perimeter.client("ec2")
+perimeter_cf = perimeter.client("cloudformation")
+elbv2 = perimeter.client("elbv2")
+autoscaling = perimeter.client("autoscaling")
+
+HEALTHY_TARGET_STATES = {"healthy"}
+SERVING_LIFECYCLE_STATES = {"InService"}
+
+
+# -------- Spoke side --------
+def get_spokes():
+    """Return (label, account_id, probe, profile) per spoke account.
+
+    probe is False for a manifest tenant without a "profile"; profile None means the current credentials.
+    """
+    if not args.manifest:
+        return [("current credentials", None, True, None)]
+    with open(args.manifest, "r") as f:
+        tenants = json.load(f).get("tenants", [])
+    return [
+        (t.get("name", t["account_id"]), t["account_id"], bool(t.get("profile")), t.get("profile"))
+        for t in tenants
+    ]
+
+
+def get_spoke_endpoints(profile, vpc_id, service_name):
+    """Return GWLBe endpoints, the AZ ID of each endpoint subnet and the matching service details."""
+    # The client is created here so a missing profile fails this tenant only
+    spoke_ec2 = boto3.Session(profile_name=profile, region_name=args.region).client("ec2") if profile else ec2
+    filters = [
+        {"Name": "vpc-endpoint-type", "Values": ["GatewayLoadBalancer"]},
+        {"Name": "service-name", "Values": [service_name]}
+    ]
+    if vpc_id:
+        filters.append({"Name": "vpc-id", "Values": [vpc_id]})
+
+    endpoints = []
+    for page in spoke_ec2.get_paginator("describe_vpc_endpoints").paginate(Filters=filters):
+        endpoints.extend(page.get("VpcEndpoints", []))
+    if not endpoints:
+        return [], {}, {}
+
+    subnet_ids = sorted({s for ep in endpoints for s in ep["SubnetIds"]})
+    subnets = spoke_ec2.describe_subnets(SubnetIds=subnet_ids)["Subnets"] if subnet_ids else []
+    subnet_az_ids = {s["SubnetId"]: s["AvailabilityZoneId"] for s in subnets}
+
+    # Only ask for the services in use instead of listing every service in the region
+    service_names = sorted({ep["ServiceName"] for ep in endpoints})
+    try:
+        details = spoke_ec2.describe_vpc_endpoint_services(ServiceNames=service_names)["ServiceDetails"]
+    except ClientError as e:
+        print(f"  Warning: Could not describe endpoint services: {e}")
+        details = []
+    services = {s["ServiceName"]: s for s in details}
+
+    return endpoints, subnet_az_ids, services
+
+
+# -------- Perimeter side --------
+def get_stack_outputs(stack_name):
+    response = perimeter_cf.describe_stacks(StackName=stack_name)
+    return {o["OutputKey"]: o["OutputValue"] for o in response["Stacks"][0].get("Outputs", [])}
+
+
+def get_endpoint_connections(service_name, service_id=None):
+    """Return the endpoint connections of the service, keyed by endpoint ID, as seen by the perimeter."""
+    if service_id is None:
+        configurations = perimeter_ec2.describe_vpc_endpoint_service_configurations(
+            Filters=[{"Name": "service-name", "Values": [service_name]}]
+        )["ServiceConfigurations"]
+        if not configurations:
+            return {}
+        service_id = configurations[0]["ServiceId"]
+    connections = {}
+    paginator = perimeter_ec2.get_paginator("describe_vpc_endpoint_connections")
+    for page in paginator.paginate(Filters=[{"Name": "service-id", "Values": [service_id]}]):
+        for connection in page.get("VpcEndpointConnections", []):
+            connections[connection["VpcEndpointId"]] = connection
+    return connections
+
+
+def get_perimeter_az_ids():
+    """Map perimeter AZ names to AZ IDs, which are stable across accounts."""
+    zones = perimeter_ec2.describe_availability_zones()["AvailabilityZones"]
+    return {z["ZoneName"]: z["ZoneId"] for z in zones}
+
+
+def get_gwlb_state(target_group_arn):
+    """Return the enabled AZ names of the GWLB behind the target group and whether cross-zone is on."""
+    target_group = elbv2.describe_target_groups(TargetGroupArns=[target_group_arn])["TargetGroups"][0]
+    lb_arns = target_group.get("LoadBalancerArns", [])
+    if not lb_arns:
+        return set(), False
+
+    load_balancer = elbv2.describe_load_balancers(LoadBalancerArns=lb_arns[:1])["LoadBalancers"][0]
+    attributes = elbv2.describe_load_balancer_attributes(LoadBalancerArn=lb_arns[0])["Attributes"]
+    cross_zone = any(
+        a["Key"] == "load_balancing.cross_zone.enabled" and a["Value"] == "true" for a in attributes
+    )
+    return {z["ZoneName"] for z in load_balancer.get("AvailabilityZones", [])}, cross_zone
 
-# -------- Initialize Boto3 Client --------
-ec2 = boto3.client("ec2", region_name=region)
 
-# -------- Retrieve GWLBe Endpoints --------
-filters = [{"Name": "vpc-endpoint-type", "Values": ["GatewayLoadBalancer"]}]
-if spoke_vpc_id:
-    filters.append({"Name": "vpc-id", "Values": [spoke_vpc_id]})
+def get_target_health(target_group_arn):
+    response = elbv2.describe_target_health(TargetGroupArn=target_group_arn)
+    return response.get("TargetHealthDescriptions", [])
 
-print("Retrieving Gateway Load Balancer Endpoints...")
-response = ec2.describe_vpc_endpoints(Filters=filters)
-endpoints = response.get("VpcEndpoints", [])
 
-if not endpoints:
-    print("No GWLBe endpoints found.")
-    exit(1)
+def get_asg_instances(asg_name):
+    response = autoscaling.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
+    groups = response.get("AutoScalingGroups", [])
+    return {i["InstanceId"]: i for i in groups[0].get("Instances", [])} if groups else {}
 
-# Fetch all service details
-services_response = ec2.describe_vpc_endpoint_services()
-service_details = services_response["ServiceDetails"]
 
-for ep in endpoints:
-    ep_id = ep["VpcEndpointId"]
-    service_name = ep["ServiceName"]
-    subnet_ids = ep["SubnetIds"]
-    vpc_id = ep["VpcId"]
+# -------- Inventory (inventory.py snapshot) --------
+def open_inventory(path):
+    if not os.path.isfile(path):
+        raise OSError(f"Inventory {path} does not exist; run 'inventory.py snapshot' first")
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    return db
 
-    print(f"\nGWLBe ID: {ep_id}")
-    print(f"  VPC ID: {vpc_id}")
-    print(f"  Subnets: {', '.join(subnet_ids)}")
-    print(f"  Service Name: {service_name}")
 
-    # Extract service ID from service name
-    service_id = service_name.split(".")[-1]
+def get_inventory_endpoints(db, account_id, vpc_id, service_name):
+    """Same result as get_spoke_endpoints, read from the inventory; account_id None means every account."""
+    rows = db.execute("""
+        SELECT e.endpoint_id, e.vpc_id, e.subnet_id, e.state, e.service_name, s.az_id
+        FROM vpc_endpoints e
+        LEFT JOIN subnets s ON s.subnet_id = e.subnet_id
+        WHERE e.region = :region AND e.service_name = :service
+          AND (:account IS NULL OR e.account_id = :account) AND (:vpc IS NULL OR e.vpc_id = :vpc)
+        ORDER BY e.endpoint_id
+    """, {"region": args.region, "service": service_name, "account": account_id, "vpc": vpc_id}).fetchall()
+    endpoints = [
+        {"VpcEndpointId": r["endpoint_id"], "VpcId": r["vpc_id"], "SubnetIds": [r["subnet_id"]] if r["subnet_id"] else [],
+         "State": r["state"], "ServiceName": r["service_name"]}
+        for r in rows
+    ]
+    subnet_az_ids = {r["subnet_id"]: r["az_id"] for r in rows if r["subnet_id"] and r["az_id"]}
+    services = {
+        r["service_name"]: {"Owner": r["account_id"], "AcceptanceRequired": bool(r["acceptance_required"])}
+        for r in db.execute("SELECT service_name, account_id, acceptance_required FROM endpoint_services "
+                            "WHERE service_name = ?", (service_name,))
+    }
+    return endpoints, subnet_az_ids, services
 
-    # Match service detail
-    matched_service = next((s for s in service_details if s["ServiceId"] == service_id), None)
 
-    if matched_service:
-        print(f"  Service ID: {matched_service['ServiceId']}")
-        print(f"  Service Owner: {matched_service['Owner']}")
-        print(f"  Acceptance Required: {matched_service['AcceptanceRequired']}")
-        print(f"  Service Type: {matched_service['ServiceType'][0]['ServiceType']}")
+def get_inventory_connections(db, service_name):
+    return {
+        r["endpoint_id"]: {"VpcEndpointId": r["endpoint_id"], "VpcEndpointOwner": r["owner_id"],
+                           "VpcEndpointState": r["state"]}
+        for r in db.execute("""
+            SELECT c.endpoint_id, c.owner_id, c.state FROM endpoint_connections c
+            JOIN endpoint_services es ON es.service_id = c.service_id
+            WHERE es.service_name = ?
+        """, (service_name,))
+    }
+
+
+def get_inventory_target_health(db, target_group_arn):
+    return [
+        {"Target": {"Id": r["target_id"], "AvailabilityZone": r["az"]}, "TargetHealth": {"State": r["health"]}}
+        for r in db.execute("SELECT target_id, az, health FROM targets WHERE target_group_arn = ?", (target_group_arn,))
+    ]
+
+
+# -------- Correlation --------
+def count_healthy_appliances(target_health, asg_instances, az_ids):
+    """Count appliances per AZ ID that pass both the GWLB health check and the ASG lifecycle check.
+
+    Targets the ASG does not know about are not counted as healthy; they are returned per AZ ID in unmanaged.
+    """
+    healthy, total, unmanaged = {}, {}, {}
+    for description in target_health:
+        instance_id = description["Target"]["Id"]
+        instance = asg_instances.get(instance_id)
+        az_name = description["Target"].get("AvailabilityZone") or (instance or {}).get("AvailabilityZone")
+        az_id = az_ids.get(az_name, az_name or "unknown")
+
+        total[az_id] = total.get(az_id, 0) + 1
+        if instance is None:
+            unmanaged[az_id] = unmanaged.get(az_id, 0) + 1
+            continue
+        in_service = instance["LifecycleState"] in SERVING_LIFECYCLE_STATES
+        if description["TargetHealth"]["State"] in HEALTHY_TARGET_STATES and in_service:
+            healthy[az_id] = healthy.get(az_id, 0) + 1
+    return healthy, total, unmanaged
+
+
+def evaluate_endpoint(ep, az_id, gwlb_az_ids, cross_zone, healthy, total_healthy):
+    """Return (status, reason) for one endpoint's inspection path."""
+    if ep["State"].lower() != "available":
+        return "FAIL", f"endpoint state is {ep['State']}"
+    if not ep["SubnetIds"]:
+        return "FAIL", "endpoint has no subnet"
+    if az_id is None:
+        return "FAIL", "AZ of the endpoint subnet could not be resolved"
+    if az_id not in gwlb_az_ids:
+        return "FAIL", "GWLB is not enabled in this AZ"
+    if healthy.get(az_id, 0) == 0:
+        if cross_zone and total_healthy:
+            return "WARN", f"no healthy appliance in AZ, served cross-zone by {total_healthy}"
+        return "FAIL", "no healthy appliance reachable"
+    return "OK", f"{healthy[az_id]} healthy appliance(s) in AZ"
+
+
+def print_endpoint(ep, tenant, az_id, status, reason, service):
+    print(f"\nGWLBe ID: {ep['VpcEndpointId']} [{status}]")
+    print(f"  Tenant: {tenant}")
+    print(f"  VPC ID: {ep['VpcId']}")
+    print(f"  Subnets: {', '.join(ep['SubnetIds'])} ({az_id})")
+    print(f"  State: {ep['State']}")
+    print(f"  Service Name: {ep['ServiceName']}")
+    if service:
+        print(f"  Service Owner: {service['Owner']}")
+        print(f"  Acceptance Required: {service['AcceptanceRequired']}")
     else:
         print("  Warning: Service details not found. The service may not be shared with this account.")
+    print(f"  Inspection path: {reason}")
+
+
+def run_probe():
+    started = time.monotonic()
+    print("Retrieving Gateway Load Balancer Endpoints and perimeter health...")
+
+    gwlb_outputs = {} if args.service_name and args.target_group_arn else get_stack_outputs(gwlb_stack_name)
+    service_name = args.service_name or gwlb_outputs["GWLBServiceName"]
+    target_group_arn = args.target_group_arn or gwlb_outputs["GWLBTargetGroupArn"]
+    asg_name = args.asg_name or get_stack_outputs(asg_stack_name)["AutoScalingGroupName"]
+    spokes = get_spokes()
+
+    # Spoke and perimeter lookups are independent, so issue them all at once
+    db = open_inventory(args.inventory) if args.inventory else None
+    with ThreadPoolExecutor(max_workers=5 + len(spokes)) as pool:
+        f_az_ids = pool.submit(get_perimeter_az_ids)
+        f_gwlb = pool.submit(get_gwlb_state, target_group_arn)
+        f_asg = pool.submit(get_asg_instances, asg_name)
+        if db:
+            # The inventory holds every snapshotted account, so tenants need no "profile" of their own
+            try:
+                spoke_results = [get_inventory_endpoints(db, account_id, args.vpc_id, service_name)
+                                 for _, account_id, _, _ in spokes]
+                connections = get_inventory_connections(db, service_name)
+                target_health = get_inventory_target_health(db, target_group_arn)
+            finally:
+                db.close()
+        else:
+            f_spokes = [pool.submit(get_spoke_endpoints, profile, args.vpc_id, service_name) if probe else None
+                        for _, _, probe, profile in spokes]
+            f_connections = pool.submit(get_endpoint_connections, service_name, gwlb_outputs.get("GWLBEndpointServiceId"))
+            f_health = pool.submit(get_target_health, target_group_arn)
+
+            spoke_results = []
+            for f in f_spokes:
+                try:
+                    spoke_results.append(f.result() if f else None)
+                except (ClientError, BotoCoreError) as e:
+                    spoke_results.append(e)  # Reported as a FAIL of this tenant only
+            connections = f_connections.result()
+            target_health = f_health.result()
+        az_ids = f_az_ids.result()
+        gwlb_az_names, cross_zone = f_gwlb.result()
+        asg_instances = f_asg.result()
+
+    gwlb_az_ids = {az_ids.get(name, name) for name in gwlb_az_names}
+    healthy, total, unmanaged = count_healthy_appliances(target_health, asg_instances, az_ids)
+    total_healthy = sum(healthy.values())
+
+    print(f"\nTarget group: {target_group_arn}")
+    print(f"  Cross-zone load balancing: {cross_zone}")
+    for az_id in sorted(set(total) | gwlb_az_ids):
+        note = f", {unmanaged[az_id]} target(s) not in {asg_name}" if unmanaged.get(az_id) else ""
+        print(f"  {az_id}: {healthy.get(az_id, 0)}/{total.get(az_id, 0)} healthy appliance(s){note}")
+
+    failed = False
+    for (tenant, account_id, _, _), result in zip(spokes, spoke_results):
+        if isinstance(result, Exception):
+            print(f"\nTenant {tenant} [FAIL]\n  Endpoint lookup failed: {result}")
+            failed = True
+            continue
+        if result is None:
+            # No tenant credentials: only the perimeter's view of the connections is available
+            owned = [c for c in connections.values() if c.get("VpcEndpointOwner") == account_id]
+            if not owned:
+                print(f"\nTenant {tenant} ({account_id}) [FAIL]\n  No endpoint connections to {service_name}.")
+                failed = True
+            for c in owned:
+                print(f"\nGWLBe ID: {c['VpcEndpointId']} [WARN]")
+                print(f"  Tenant: {tenant}")
+                print(f"  Connection state: {c['VpcEndpointState']}")
+                print("  Inspection path: not checked per AZ; add a \"profile\" for this tenant to the manifest")
+            continue
+
+        endpoints, subnet_az_ids, services = result
+        if not endpoints:
+            print(f"\nTenant {tenant} [FAIL]\n  No GWLBe endpoints found for {service_name}.")
+            failed = True
+        for ep in endpoints:
+            az_id = subnet_az_ids.get(ep["SubnetIds"][0]) if ep["SubnetIds"] else None
+            status, reason = evaluate_endpoint(ep, az_id, gwlb_az_ids, cross_zone, healthy, total_healthy)
+            connection = connections.get(ep["VpcEndpointId"])
+            if connection and connection["VpcEndpointState"].lower() != "available" and status != "FAIL":
+                status, reason = "FAIL", f"perimeter sees the connection as {connection['VpcEndpointState']}"
+            failed = failed or status == "FAIL"
+            print_endpoint(ep, tenant, az_id, status, reason, services.get(ep["ServiceName"]))
+
+    print(f"\nValidation complete in {time.monotonic() - started:.1f}s: {'FAILED' if failed else 'healthy'}.")
+    return not failed
+
 
-print("\nValidation complete.")
+if __name__ == "__main__":
+    while True:
+        try:
+            healthy_path = run_probe()
+        except (ClientError, BotoCoreError, KeyError, OSError, ValueError, sqlite3.Error) as e:
+            print(f"[ERROR] Probe failed: {e}")
+            healthy_path = False
+        if not args.interval:
+            sys.exit(0 if healthy_path else 1)
+        time.sleep(args.interval)
@@ -0,0 +1,304 @@
+import os
+import re
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError, BotoCoreError
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+SUBNET_ROLE_PATTERN = re.compile(r"-([a-z]+)(?:-subnet)?-az\d+$")  # customer-egress-private-subnet-az1, SecurityPerimeter-tgw-az1
+TERMINAL_PREFIXES = ("igw-", "tgw-", "vgw-", "pcx-", "eigw-", "eni-")
+MAX_HOPS = 6
+# Route target prefix -> key of the route as EC2 returns it; inventory.py stores only the target
+TARGET_KEYS = {"vpce-": "VpcEndpointId", "nat-": "NatGatewayId", "tgw-": "TransitGatewayId",
+               "eni-": "NetworkInterfaceId", "pcx-": "VpcPeeringConnectionId", "eigw-": "EgressOnlyInternetGatewayId"}
+
+# --- Argument parsing ---
+parser = argparse.ArgumentParser(description="Verify that every subnet's path stays in its AZ and passes the GWLB endpoints.")
+parser.add_argument('--region', default="ap-southeast-1", help='Region of the VPCs.')
+parser.add_argument('--profile', help='AWS profile of the account owning the VPCs (default: current credentials).')
+parser.add_argument('--vpc-id', action='append', dest='vpc_ids', help='VPC to verify (repeatable; default: all VPCs in the region).')
+parser.add_argument('--destination', default="0.0.0.0/0", help='Destination CIDR whose path is verified.')
+parser.add_argument('--inspect-roles', default="private,tgw", help='Subnet roles (from the Name tag) whose traffic must pass a GWLBe.')
+parser.add_argument('--emit-params', metavar='DIR', help='Write corrected gwlbe-routes parameter files per VPC and subnet role into DIR.')
+parser.add_argument('--json', action='store_true', help='Print findings and corrections as JSON.')
+parser.add_argument('--inventory', metavar='DB', help='Read the topology from an inventory.py database instead of the EC2 APIs.')
+
+def describe_all(ec2, operation, result_key, vpc_ids, extra_filters=None, filter_param="Filters"):
+    """Run one paginated describe call for all VPCs at once."""
+    filters = list(extra_filters or [])
+    if vpc_ids:
+        filters.append({"Name": "vpc-id", "Values": vpc_ids})
+    items = []
+    for page in ec2.get_paginator(operation).paginate(**{filter_param: filters}):
+        items.extend(page.get(result_key, []))
+    return items
+
+def load_topology(ec2, vpc_ids):
+    """Fetch route tables, subnets, GWLB endpoints and NAT gateways concurrently."""
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        f_tables = pool.submit(describe_all, ec2, 'describe_route_tables', 'RouteTables', vpc_ids)
+        f_subnets = pool.submit(describe_all, ec2, 'describe_subnets', 'Subnets', vpc_ids)
+        f_endpoints = pool.submit(describe_all, ec2, 'describe_vpc_endpoints', 'VpcEndpoints', vpc_ids,
+                                  extra_filters=[{"Name": "vpc-endpoint-type", "Values": ["GatewayLoadBalancer"]}])
+        f_nats = pool.submit(describe_all, ec2, 'describe_nat_gateways', 'NatGateways', vpc_ids,
+                             extra_filters=[{"Name": "state", "Values": ["available"]}], filter_param="Filter")
+        route_tables, subnets = f_tables.result(), f_subnets.result()
+        endpoints, nat_gateways = f_endpoints.result(), f_nats.result()
+
+    topology = {"subnets": {}, "subnet_tables": {}, "main_tables": {}, "tables": {}, "hops": {}}
+    for subnet in subnets:
+        name = next((t["Value"] for t in subnet.get("Tags", []) if t["Key"] == "Name"), "")
+        match = SUBNET_ROLE_PATTERN.search(name)
+        topology["subnets"][subnet["SubnetId"]] = {
+            "vpc": subnet["VpcId"], "az": subnet["AvailabilityZone"], "name": name,
+            "role": match.group(1) if match else None
+        }
+    for table in route_tables:
+        topology["tables"][table["RouteTableId"]] = table
+        for association in table.get("Associations", []):
+            if association.get("Main"):
+                topology["main_tables"][table["VpcId"]] = table["RouteTableId"]
+            elif association.get("SubnetId"):
+                topology["subnet_tables"][association["SubnetId"]] = table["RouteTableId"]
+    for endpoint in endpoints:
+        subnet_id = endpoint["SubnetIds"][0] if endpoint["SubnetIds"] else None
+        topology["hops"][endpoint["VpcEndpointId"]] = {"subnet": subnet_id, "service": endpoint["ServiceName"]}
+    for nat in nat_gateways:
+        topology["hops"][nat["NatGatewayId"]] = {"subnet": nat["SubnetId"]}
+    return topology
+
+def load_inventory_topology(db_path, region, vpc_ids):
+    """Build the same topology from a local inventory.py snapshot, without any EC2 call."""
+    if not os.path.isfile(db_path):
+        raise OSError(f"Inventory {db_path} does not exist; run 'inventory.py snapshot' first")
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    scope = "region = ?"
+    params = [region]
+    if vpc_ids:
+        scope += f" AND vpc_id IN ({','.join('?' * len(vpc_ids))})"
+        params += sorted(vpc_ids)
+
+    topology = {"subnets": {}, "subnet_tables": {}, "main_tables": {}, "tables": {}, "hops": {}}
+    try:
+        for subnet in db.execute(f"SELECT subnet_id, vpc_id, az, name FROM subnets WHERE {scope}", params):
+            match = SUBNET_ROLE_PATTERN.search(subnet["name"] or "")
+            topology["subnets"][subnet["subnet_id"]] = {
+                "vpc": subnet["vpc_id"], "az": subnet["az"], "name": subnet["name"] or "",
+                "role": match.group(1) if match else None
+            }
+        for table in db.execute(f"SELECT route_table_id, vpc_id, main FROM route_tables WHERE {scope}", params):
+            topology["tables"][table["route_table_id"]] = {
+                "RouteTableId": table["route_table_id"], "VpcId": table["vpc_id"], "Routes": []
+            }
+            if table["main"]:
+                topology["main_tables"][table["vpc_id"]] = table["route_table_id"]
+        tables = f"SELECT route_table_id FROM route_tables WHERE {scope}"
+        for association in db.execute(f"SELECT subnet_id, route_table_id FROM route_table_subnets "
+                                      f"WHERE route_table_id IN ({tables})", params):
+            topology["subnet_tables"][association["subnet_id"]] = association["route_table_id"]
+        for route in db.execute(f"SELECT route_table_id, destination, target, state FROM routes "
+                                f"WHERE route_table_id IN ({tables})", params):
+            if route["destination"].startswith("pl-"):
+                continue
+            target = route["target"] or ""
+            key = next((k for prefix, k in TARGET_KEYS.items() if target.startswith(prefix)), "GatewayId")
+            topology["tables"][route["route_table_id"]]["Routes"].append(
+                {"DestinationCidrBlock": route["destination"], "State": route["state"], key: route["target"]}
+            )
+        for endpoint in db.execute(f"SELECT endpoint_id, subnet_id, service_name FROM vpc_endpoints WHERE {scope}",
+                                   params):
+            topology["hops"][endpoint["endpoint_id"]] = {"subnet": endpoint["subnet_id"],
+                                                         "service": endpoint["service_name"]}
+        for nat in db.execute(f"SELECT nat_gateway_id, subnet_id FROM nat_gateways WHERE {scope}", params):
+            topology["hops"][nat["nat_gateway_id"]] = {"subnet": nat["subnet_id"]}
+    finally:
+        db.close()
+    return topology
+
+def route_table_for(topology, subnet_id):
+    return topology["subnet_tables"].get(subnet_id) or topology["main_tables"].get(topology["subnets"][subnet_id]["vpc"])
+
+def lookup_route(table, destination):
+    """Longest-prefix match of destination in a route table."""
+    best, best_len = None, -1
+    for route in table.get("Routes", []):
+        cidr = route.get("DestinationCidrBlock")
+        if not cidr:
+            continue
+        network = ipaddress.ip_network(cidr)
+        if destination.subnet_of(network) and network.prefixlen > best_len:
+            best, best_len = route, network.prefixlen
+    return best
+
+def route_target(route):
+    for key in ("VpcEndpointId", "NatGatewayId", "TransitGatewayId", "GatewayId",
+                "NetworkInterfaceId", "VpcPeeringConnectionId", "EgressOnlyInternetGatewayId"):
+        if route.get(key):
+            return route[key]
+    return None
+
+def trace_path(topology, subnet_id, destination):
+    """Follow the next-hop chain from a subnet; return (hops, terminal, problem)."""
+    hops, seen = [], set()
+    current = subnet_id
+    for _ in range(MAX_HOPS):
+        table_id = route_table_for(topology, current)
+        route = lookup_route(topology["tables"].get(table_id, {}), destination)
+        if route is None:
+            return hops, None, f"no route in {table_id}"
+        if route.get("State") == "blackhole":
+            return hops, None, f"blackhole route in {table_id}"
+        target = route_target(route)
+        if target is None or target == "local" or target.startswith(TERMINAL_PREFIXES):
+            return hops, target, None
+        if target in seen:
+            return hops, None, f"routing loop at {target}"
+        seen.add(target)
+
+        hop = topology["hops"].get(target)
+        if hop is None or hop["subnet"] not in topology["subnets"]:
+            return hops, target, None
+        hops.append({"target": target, "table": table_id, "az": topology["subnets"][hop["subnet"]]["az"]})
+        current = hop["subnet"]
+    return hops, None, "too many hops"
+
+def same_az_replacement(topology, target, az, vpc_id):
+    """Find a resource of the same kind (same service for GWLBe) in the given AZ of the VPC."""
+    original = topology["hops"][target]
+    for candidate, hop in topology["hops"].items():
+        subnet = topology["subnets"].get(hop["subnet"])
+        if (candidate[:4] == target[:4] and subnet and subnet["az"] == az and subnet["vpc"] == vpc_id
+                and hop.get("service") == original.get("service")):
+            return candidate
+    return None
+
+def same_az_endpoint(topology, az, vpc_id):
+    for candidate, hop in topology["hops"].items():
+        subnet = topology["subnets"].get(hop["subnet"])
+        if candidate.startswith("vpce-") and subnet and subnet["az"] == az and subnet["vpc"] == vpc_id:
+            return candidate
+    return None
+
+def verify(topology, destination, inspect_roles):
+    findings, corrections = [], {}
+    for subnet_id, subnet in sorted(topology["subnets"].items(), key=lambda kv: (kv[1]["vpc"], kv[1]["name"])):
+        hops, terminal, problem = trace_path(topology, subnet_id, destination)
+        chain = " -> ".join([subnet_id] + [f"{h['target']}({h['az']})" for h in hops] + ([terminal] if terminal else []))
+        label = subnet["name"] or subnet_id
+
+        if problem:
+            # Subnets without a default route (e.g. perimeter GWLB subnets) are fine unless they must be inspected
+            if hops or subnet["role"] in inspect_roles:
+                findings.append({"subnet": label, "vpc": subnet["vpc"], "issue": problem, "path": chain})
+            continue
+
+        for hop in hops:
+            if hop["az"] != subnet["az"]:
+                findings.append({"subnet": label, "vpc": subnet["vpc"], "path": chain,
+                                 "issue": f"{hop['target']} in {hop['az']} leaves {subnet['az']}"})
+                fix = same_az_replacement(topology, hop["target"], subnet["az"], subnet["vpc"])
+                if fix:
+                    corrections[(hop["table"], str(destination))] = {"current": hop["target"], "proposed": fix}
+                break
+
+        if subnet["role"] in inspect_roles and terminal != "local" and not any(h["target"].startswith("vpce-") for h in hops):
+            findings.append({"subnet": label, "vpc": subnet["vpc"], "path": chain, "issue": "skips GWLB inspection"})
+            fix = same_az_endpoint(topology, subnet["az"], subnet["vpc"])
+            table_id = route_table_for(topology, subnet_id)
+            if fix:
+                current = hops[0]["target"] if hops else terminal
+                corrections[(table_id, str(destination))] = {"current": current, "proposed": fix}
+
+    return findings, [
+        {"RouteTableId": table_id, "DestinationCidrBlock": cidr, **change}
+        for (table_id, cidr), change in sorted(corrections.items())
+    ]
+
+def write_route_parameters(topology, destination, inspect_roles, out_dir):
+    """Write a gwlbe-routes parameter file per VPC and inspected subnet role, wiring each of the role's
+    route tables to its own AZ's GWLBe. Roles have their own route table per AZ (e.g. private and tgw),
+    so each role needs its own gwlbe-routes stack. Returns the written paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    per_role = {}
+    for subnet_id, subnet in sorted(topology["subnets"].items()):
+        if subnet["role"] not in inspect_roles:
+            continue
+        tables = per_role.setdefault((subnet["vpc"], subnet["role"]), {})
+        table_id = route_table_for(topology, subnet_id)
+        if tables.get(subnet["az"], table_id) != table_id:
+            logger.warning(f"{subnet['vpc']}: {subnet['role']} subnets in {subnet['az']} use several route tables; "
+                           f"keeping {tables[subnet['az']]}")
+            continue
+        tables[subnet["az"]] = table_id
+
+    paths = []
+    for (vpc_id, role), tables in sorted(per_role.items()):
+        azs = sorted(tables)
+        if len(azs) != 3:
+            logger.warning(f"{vpc_id} {role}: gwlbe-routes.yaml expects 3 AZs, found {len(azs)}; skipping")
+            continue
+        parameters = [{"ParameterKey": "ProjectName", "ParameterValue": f"{vpc_id}-{role}"}]
+        for i, az in enumerate(azs, start=1):
+            endpoint = same_az_endpoint(topology, az, vpc_id)
+            if endpoint is None:
+                logger.warning(f"{vpc_id} {role}: no GWLBe in {az}; skipping")
+                break
+            parameters.append({"ParameterKey": f"GWLBeEndpointIdAZ{i}", "ParameterValue": endpoint})
+            parameters.append({"ParameterKey": f"RouteTableIdAZ{i}", "ParameterValue": tables[az]})
+        else:
+            parameters.append({"ParameterKey": "RouteDestinationCidr", "ParameterValue": str(destination)})
+            path = os.path.join(out_dir, f"{vpc_id}-{role}-gwlbe-routes-parameters.json")
+            with open(path, 'w') as f:
+                json.dump(parameters, f, indent=4)
+            logger.info(f"Wrote corrected route parameters to {path}")
+            paths.append(path)
+    return paths
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    destination = ipaddress.ip_network(args.destination)
+    inspect_roles = set(r.strip() for r in args.inspect_roles.split(",") if r.strip())
+
+    try:
+        if args.inventory:
+            topology = load_inventory_topology(args.inventory, args.region, args.vpc_ids)
+        else:
+            ec2 = boto3.Session(profile_name=args.profile, region_name=args.region).client('ec2')
+            topology = load_topology(ec2, args.vpc_ids)
+    except (ClientError, BotoCoreError, OSError, sqlite3.Error) as e:
+        logger.error(f"Failed to load VPC topology: {e}")
+        sys.exit(1)
+
+    findings, corrections = verify(topology, destination, inspect_roles)
+
+    if args.json:
+        print(json.dumps({"findings": findings, "corrections": corrections}, indent=2))
+    else:
+        logger.info(f"Verified {len(topology['subnets'])} subnet(s) and {len(topology['tables'])} route table(s).")
+        for finding in findings:
+            logger.warning(f"[{finding['vpc']}] {finding['subnet']}: {finding['issue']}")
+            logger.warning(f"    path: {finding['path']}")
+        for correction in corrections:
+            logger.info(f"Correct {correction['RouteTableId']} {correction['DestinationCidrBlock']}: "
+                        f"{correction['current']} -> {correction['proposed']}")
+        if not findings:
+            logger.info("All paths stay in their AZ and pass inspection where required.")
+
+    if args.emit_params:
+        write_route_parameters(topology, destination, inspect_roles, args.emit_params)
+
+    sys.exit(1 if findings else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,53 @@
 import boto3
+import os
 import sys
+import json
 
-def add_vpc_endpoint_service_permission(region, target_account):
-    ec2 = boto3.client('ec2', region_name=region)
-    sts = boto3.client('sts')
-    account_id = sts.get_caller_identity()['Account']
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import service_registry
+
+PROJECT_NAME = "SecurityPerimeter"
+TENANT_MANIFEST = os.path.join("parameters", "tenant-manifest.json")
+
+# Manual fallback only: deployment.py grants AllowedPrincipals through GWLBStack from the same manifest.
+# Principals added here are not tracked by the stack, so remove a tenant from the manifest and redeploy
+# rather than relying on this script.
 
+def get_registered_service(region):
+    """Return the service published by deployment.py, or None when it is not registered."""
+    try:
+        return {
+            "ServiceId": service_registry.resolve(PROJECT_NAME, "GWLBEndpointServiceId", region=region, refresh=True),
+            "ServiceName": service_registry.resolve(PROJECT_NAME, "GWLBServiceName", region=region)
+        }
+    except Exception as e:
+        print(f"[WARN] Service registry lookup failed: {e}")
+        return None
+
+def find_owned_service(ec2, region):
+    """Return the registered service, or the first endpoint service owned by the current account."""
+    owned_service = get_registered_service(region)
+    if owned_service:
+        print(f"[INFO] Using registered service from {service_registry.REGISTRY_PREFIX}/{PROJECT_NAME}")
+        return owned_service
+
+    account_id = boto3.client('sts').get_caller_identity()['Account']
     print(f"[INFO] Scanning for VPC Endpoint Services in region: {region} (Account: {account_id})")
 
     paginator = ec2.get_paginator('describe_vpc_endpoint_services')
-    owned_service = None
 
     try:
         for page in paginator.paginate():
             for service in page.get('ServiceDetails', []):
                 if service.get('Owner') == account_id:
-                    owned_service = service
-                    break
-            if owned_service:
-                break
+                    return service
     except Exception as e:
         print(f"[ERROR] Failed to fetch services: {e}")
         sys.exit(1)
+    return None
 
-    if not owned_service:
-        print("[ERROR] No VPC endpoint services owned by this account.")
-        sys.exit(1)
-
-    service_id = owned_service['ServiceId']
-    service_name = owned_service['ServiceName']
-
-    print(f"[INFO] Found service: {service_name}")
+def add_vpc_endpoint_service_permission(ec2, service_id, target_account):
     print(f"[INFO] Adding permission for account {target_account}...")
 
     principal_arn = f"arn:aws:iam::{target_account}:root"
@@ -47,5 +64,17 @@ def add_vpc_endpoint_service_permission(region, target_account):
 
 if __name__ == "__main__":
     region = "ap-southeast-1"
-    target_account = "975050199901"
-    add_vpc_endpoint_service_permission(region, target_account)
+    manifest_path = sys.argv[1] if len(sys.argv) > 1 else TENANT_MANIFEST
+    with open(manifest_path, 'r') as f:
+        tenants = json.load(f).get("tenants", [])
+
+    # One service lookup for all tenants
+    ec2 = boto3.client('ec2', region_name=region)
+    owned_service = find_owned_service(ec2, region)
+    if not owned_service:
+        print("[ERROR] No VPC endpoint services owned by this account.")
+        sys.exit(1)
+    print(f"[INFO] Found service: {owned_service['ServiceName']}")
+
+    for tenant in tenants:
+        add_vpc_endpoint_service_permission(ec2, owned_service['ServiceId'], tenant["account_id"])
@@ -0,0 +1,148 @@
+import boto3
+import sys
+import os
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import log_pipeline
+
+# --- Logging setup ---
+log_pipeline.setup_logging("endpoint-connections.log")
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+TENANT_MANIFEST = os.path.join("parameters", "tenant-manifest.json")
+GWLB_STACK_NAME = "GWLBStack"
+BATCH_SIZE = 50  # Endpoint IDs per accept/reject call
+
+# --- Argument parsing ---
+parser = argparse.ArgumentParser(description="Accept or reject pending GWLB endpoint connections against the tenant manifest.")
+parser.add_argument('--region', default="ap-southeast-1", help='Region of the GWLB endpoint service.')
+parser.add_argument('--service-id', help='VPCE service ID (default: GWLBEndpointServiceId output of the GWLB stack).')
+parser.add_argument('--manifest', default=TENANT_MANIFEST, help='Tenant manifest listing the accepted account IDs.')
+parser.add_argument('--leave-unknown', action='store_true', help='Leave connections from unknown accounts pending instead of rejecting them.')
+parser.add_argument('--dry-run', action='store_true', help='Only report what would be accepted or rejected.')
+parser.add_argument('--watch', action='store_true', help='Keep polling for new pending connections.')
+parser.add_argument('--interval', type=int, default=5, help='Polling interval in seconds for --watch.')
+args = parser.parse_args()
+
+# --- AWS clients ---
+cf = boto3.client('cloudformation', region_name=args.region)
+ec2 = boto3.client('ec2', region_name=args.region)
+
+def get_service_id():
+    if args.service_id:
+        return args.service_id
+    try:
+        response = cf.describe_stacks(StackName=GWLB_STACK_NAME)
+    except ClientError as e:
+        logger.error(f"Failed to read outputs of {GWLB_STACK_NAME}: {e}")
+        sys.exit(1)
+    for output in response['Stacks'][0].get('Outputs', []):
+        if output['OutputKey'] == "GWLBEndpointServiceId":
+            return output['OutputValue']
+    logger.error(f"Output 'GWLBEndpointServiceId' not found in {GWLB_STACK_NAME}; pass --service-id.")
+    sys.exit(1)
+
+def load_tenants(manifest_path):
+    """Map tenant account IDs to tenant names."""
+    with open(manifest_path, 'r') as f:
+        tenants = json.load(f).get("tenants", [])
+    return {t["account_id"]: t["name"] for t in tenants}
+
+def list_pending_connections(service_id):
+    paginator = ec2.get_paginator('describe_vpc_endpoint_connections')
+    connections = []
+    for page in paginator.paginate(
+        Filters=[
+            {"Name": "service-id", "Values": [service_id]},
+            {"Name": "vpc-endpoint-state", "Values": ["pendingAcceptance"]}
+        ],
+        PaginationConfig={"PageSize": 1000}
+    ):
+        connections.extend(page.get('VpcEndpointConnections', []))
+    return connections
+
+def apply_batch(action, service_id, endpoint_ids, owners):
+    """Accept or reject one batch of endpoints and return the IDs that failed."""
+    call = ec2.accept_vpc_endpoint_connections if action == "accept" else ec2.reject_vpc_endpoint_connections
+    try:
+        response = call(ServiceId=service_id, VpcEndpointIds=endpoint_ids)
+    except ClientError as e:
+        logger.error(f"Failed to {action} {len(endpoint_ids)} endpoint(s): {e}")
+        return endpoint_ids
+    failed = []
+    for item in response.get('Unsuccessful', []):
+        log = log_pipeline.context_logger(logger, tenant=owners.get(item['ResourceId']), phase=action)
+        log.error(f"Failed to {action} {item['ResourceId']}: {item['Error']['Message']}")
+        failed.append(item['ResourceId'])
+    return failed
+
+def process_pending(service_id, tenants):
+    """Match pending connections to tenants and accept/reject them in batches; return the number that failed."""
+    connections = list_pending_connections(service_id)
+    if not connections:
+        return 0
+
+    to_accept, to_reject, owners = [], [], {}
+    for connection in connections:
+        endpoint_id = connection['VpcEndpointId']
+        owner = connection['VpcEndpointOwner']
+        if owner in tenants:
+            owners[endpoint_id] = tenants[owner]
+            log = log_pipeline.context_logger(logger, tenant=tenants[owner], phase="accept")
+            log.info(f"Accepting {endpoint_id} from {owner} (tenant {tenants[owner]})")
+            to_accept.append(endpoint_id)
+        elif args.leave_unknown:
+            logger.warning(f"Leaving {endpoint_id} from unknown account {owner} pending")
+        else:
+            logger.warning(f"Rejecting {endpoint_id} from unknown account {owner}")
+            to_reject.append(endpoint_id)
+
+    if args.dry_run:
+        logger.info(f"[DRY RUN] Would accept {len(to_accept)} and reject {len(to_reject)} endpoint(s).")
+        return 0
+
+    batches = [("accept", to_accept[i:i + BATCH_SIZE]) for i in range(0, len(to_accept), BATCH_SIZE)]
+    batches += [("reject", to_reject[i:i + BATCH_SIZE]) for i in range(0, len(to_reject), BATCH_SIZE)]
+    if not batches:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=min(len(batches), 8)) as pool:
+        failed = {f for result in pool.map(lambda b: apply_batch(b[0], service_id, b[1], owners), batches) for f in result}
+
+    accepted = sum(1 for e in to_accept if e not in failed)
+    rejected = sum(1 for e in to_reject if e not in failed)
+    logger.info(f"Accepted {accepted}, rejected {rejected}, failed {len(failed)} endpoint connection(s).")
+    return len(failed)
+
+if __name__ == "__main__":
+    service_id = get_service_id()
+    logger.info(f"Processing pending endpoint connections for service {service_id}")
+
+    tenants = None
+    while True:
+        # Reload the manifest every pass so newly onboarded tenants are picked up without a restart
+        try:
+            tenants = load_tenants(args.manifest)
+        except (OSError, ValueError, KeyError) as e:
+            if tenants is None and not args.watch:
+                logger.error(f"Failed to read tenant manifest {args.manifest}: {e}")
+                sys.exit(1)
+            logger.error(f"Failed to read tenant manifest {args.manifest}, keeping the last good tenant set: {e}")
+        failed = 0
+        if tenants is not None:
+            try:
+                failed = process_pending(service_id, tenants)
+            except ClientError as e:
+                logger.error(f"Failed to list endpoint connections: {e}")
+                failed = 1
+        if not args.watch:
+            sys.exit(1 if failed else 0)
+        time.sleep(args.interval)
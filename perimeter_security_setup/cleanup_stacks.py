@@ -1,20 +1,19 @@
 import boto3
+import os
 import sys
 import time
 import logging
 from botocore.exceptions import ClientError, BotoCoreError
 
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import log_pipeline
+
 # ---------------------------
 # CONFIGURE LOGGING
 # ---------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    handlers=[
-        logging.FileHandler("cleanup.log", encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Records are queued and written by a background thread to logs/cleanup.log (rotating, JSON)
+log_pipeline.setup_logging("cleanup.log", stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
 # ---------------------------
@@ -41,44 +40,45 @@ STACKS = [
 # DELETE STACK FUNCTION
 # ---------------------------
 def delete_stack(stack_name):
-    logger.info(f"[START] Deleting stack: {stack_name}")
+    log = log_pipeline.context_logger(logger, stack=stack_name, phase="delete")
+    log.info(f"[START] Deleting stack: {stack_name}")
     try:
         cf.describe_stacks(StackName=stack_name)
     except ClientError as e:
         if "does not exist" in str(e):
-            logger.warning(f"[SKIP] Stack {stack_name} does not exist.")
+            log.warning(f"[SKIP] Stack {stack_name} does not exist.")
             return
         else:
-            logger.error(f"[ERROR] Describe failed for {stack_name}: {e}")
+            log.error(f"[ERROR] Describe failed for {stack_name}: {e}")
             raise
 
     try:
         cf.delete_stack(StackName=stack_name)
-        logger.info(f"[DELETE] Delete request sent for stack: {stack_name}")
-        wait_for_stack_deletion(stack_name)
+        log.info(f"[DELETE] Delete request sent for stack: {stack_name}")
+        wait_for_stack_deletion(stack_name, log)
     except ClientError as e:
-        logger.error(f"[ERROR] Failed to delete {stack_name}: {e}")
+        log.error(f"[ERROR] Failed to delete {stack_name}: {e}")
         raise
 
-def wait_for_stack_deletion(stack_name):
+def wait_for_stack_deletion(stack_name, log):
     timeout = 900  # seconds
     interval = 10
     elapsed = 0
 
-    logger.info(f"Waiting for stack '{stack_name}' to be deleted...")
+    log.info(f"Waiting for stack '{stack_name}' to be deleted...")
 
     while elapsed < timeout:
         time.sleep(interval)
         elapsed += interval
         try:
             cf.describe_stacks(StackName=stack_name)
-            logger.info(f"  -> {stack_name} still deleting...")
+            log.info(f"  -> {stack_name} still deleting...")
         except ClientError as e:
             if "does not exist" in str(e):
-                logger.info(f"[COMPLETE] Stack {stack_name} successfully deleted.")
+                log.info(f"[COMPLETE] Stack {stack_name} successfully deleted.")
                 return
             else:
-                logger.error(f"[ERROR] Checking deletion status failed: {e}")
+                log.error(f"[ERROR] Checking deletion status failed: {e}")
                 raise
 
     raise TimeoutError(f"Timeout waiting for stack {stack_name} deletion.")
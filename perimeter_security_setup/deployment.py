@@ -1,27 +1,49 @@
 import boto3
 import sys
 import os
+import json
 import logging
-import subprocess
 import argparse
 from botocore.exceptions import ClientError
 
-# --- Logging setup ---
-logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import change_sets
+import log_pipeline
+import preflight
+import service_registry
+
 logger = logging.getLogger(__name__)
 
 # --- AWS clients ---
 cf = boto3.client('cloudformation')
 ec2 = boto3.client('ec2')
-sts = boto3.client('sts')
 
 # --- Constants ---
 TEMPLATE_DIR = "templates"
+TENANT_MANIFEST = os.path.join("parameters", "tenant-manifest.json")
+REGISTRY_KEYS = ["GWLBServiceName", "GWLBEndpointServiceId", "GWLBArn", "GWLBTargetGroupArn"]
 
 # --- Argument parsing ---
 parser = argparse.ArgumentParser()
 parser.add_argument('--force', action='store_true', help='Force update stacks even if already completed.')
-args = parser.parse_args()
+parser.add_argument('--plan', action='store_true', help='Create change sets for all stacks and report them before executing.')
+parser.add_argument('--execute', action='store_true', help='With --plan, execute the change sets without prompting.')
+parser.add_argument('--skip-preflight', action='store_true', help='Skip validating AMIs, key pairs, AZs, instance types and CIDRs before deploying.')
+parser.add_argument('--registry', default='ssm', help="Where to publish the GWLB service outputs: 'ssm' or 'file:<path>'.")
+parser.add_argument('--manifest', default=TENANT_MANIFEST, help='Tenant manifest whose accounts are granted AllowedPrincipals on the endpoint service.')
+
+# --- Tenant manifest ---
+def load_tenant_principals(manifest_path=TENANT_MANIFEST):
+    """Return the comma-separated root principals of every tenant account in the manifest.
+
+    Raises ValueError when the manifest lists no tenants, since an empty principal is rejected by CloudFormation.
+    """
+    with open(manifest_path, 'r') as f:
+        tenants = json.load(f).get("tenants", [])
+    if not tenants:
+        raise ValueError(f"no tenants in {manifest_path}; AllowedPrincipals needs at least one tenant account")
+    return ",".join(f"arn:aws:iam::{t['account_id']}:root" for t in tenants)
 
 # --- VPC Stack deployment definition ---
 vpc_stack_definition = {
@@ -55,8 +77,10 @@ security_group_stack_definition = {
     "name": "FortiGateSecurityGroupStack",
     "template": "ngfw-security-group.yaml",
     "parameters": [
-        {"ParameterKey": "ProjectName", "ParameterValue": "SecurityPerimeter"},
-        {"ParameterKey": "VpcId", "ParameterValue": ""}  # VPC ID will be set later
+        {"ParameterKey": "ProjectName", "ParameterValue": "SecurityPerimeter"}
+    ],
+    "parameters_from_outputs": [
+        {"output_key": "VpcId", "parameter_key": "VpcId"}
     ],
     "outputs": [
         "SecurityGroupId"
@@ -69,12 +93,22 @@ gwlb_stack_definition = {
     "template": "gwlb.yaml",  # New template file for the GWLB
     "parameters": [
         {"ParameterKey": "ProjectName", "ParameterValue": "SecurityPerimeter"},
-        {"ParameterKey": "VpcId", "ParameterValue": ""},  # VPC ID will be set later
-        {"ParameterKey": "GWLBSubnetIds", "ParameterValue": ""}  # Subnet IDs will be set later
+        {"ParameterKey": "AcceptanceRequired", "ParameterValue": "false"}  # "true" to gate tenants via accept_endpoint_connections.py
+    ],
+    "parameters_from_manifest": [
+        {"parameter_key": "AllowedPrincipals"}  # Root principals of the tenant accounts, read when the stack is resolved
+    ],
+    "parameters_from_outputs": [
+        {"output_key": "VpcId", "parameter_key": "VpcId"},
+        {
+            "output_keys": ["GWLBSubnet1Id", "GWLBSubnet2Id", "GWLBSubnet3Id"],
+            "parameter_key": "GWLBSubnetIds"
+        }
     ],
     "outputs": [
         "GWLBArn",
         "GWLBTargetGroupArn",
+        "GWLBEndpointServiceId",
         "GWLBServiceName"
     ]
 }
@@ -84,9 +118,14 @@ gwlb_endpoint_stack_definition = {
     "name": "GWLBeStack",
     "template": "gwlb-endpoint.yaml",  # New template file for the GWLBe
     "parameters": [
-        {"ParameterKey": "ProjectName", "ParameterValue": "SecurityPerimeter"},
-        {"ParameterKey": "VpcId", "ParameterValue": ""},  # VPC ID will be set later
-        {"ParameterKey": "GWLBEndpointSubnetIds", "ParameterValue": ""}  # Subnet IDs will be set later
+        {"ParameterKey": "ProjectName", "ParameterValue": "SecurityPerimeter"}
+    ],
+    "parameters_from_outputs": [
+        {"output_key": "VpcId", "parameter_key": "VpcId"},
+        {
+            "output_keys": ["GWLBeSubnet1Id", "GWLBeSubnet2Id", "GWLBeSubnet3Id"],
+            "parameter_key": "GWLBEndpointSubnetIds"
+        }
     ],
     "outputs": [
         "GWLBEndpoint1Id",
@@ -101,152 +140,66 @@ asg_stack_definition = {
     "template": "ec2-appliance.yaml",  # New template file for the Auto Scaling Group
     "parameters": [
         {"ParameterKey": "ProjectName", "ParameterValue": "SecurityPerimeter"},
-        {"ParameterKey": "SecuritySubnetIds", "ParameterValue": ""},  # Security Subnet IDs will be set later
-        {"ParameterKey": "GWLBSubnetIds", "ParameterValue": ""},  # GWLB Subnet IDs will be set later
-        {"ParameterKey": "SecurityGroupId", "ParameterValue": ""},  # Security Group ID will be set later
         {"ParameterKey": "AmiId", "ParameterValue": "ami-0435fcf800fb5418d"},  # Static AMI ID
-        {"ParameterKey": "GWLBTargetGroupArn", "ParameterValue": ""},  # GWLB Target Group ARN will be set later
         {"ParameterKey": "KeyPairName", "ParameterValue": "ngfw-key-pair"},  # Static Key Pair Name
         {"ParameterKey": "InstanceType", "ParameterValue": "t3.micro"},  # Default instance type
-        {"ParameterKey": "NumberOfAZs", "ParameterValue": "3"}  # Default number of AZs
+        {"ParameterKey": "NumberOfAZs", "ParameterValue": "3"},  # Default number of AZs
+        {"ParameterKey": "MaxSize", "ParameterValue": "6"},  # Scale-out headroom above one appliance per AZ
+        {"ParameterKey": "HealthCheckGracePeriod", "ParameterValue": "180"},
+        {"ParameterKey": "LaunchHookHeartbeatTimeout", "ParameterValue": "300"},  # Cold-launch boot allowance
+        {"ParameterKey": "WarmPoolEnabled", "ParameterValue": "false"},
+        {"ParameterKey": "WarmPoolMinSize", "ParameterValue": "1"},
+        {"ParameterKey": "WarmPoolMaxPreparedCapacity", "ParameterValue": "-1"},  # -1: up to the group's MaxSize
+        {"ParameterKey": "WarmPoolState", "ParameterValue": "Stopped"},  # Stopped, Hibernated or Running
+        {"ParameterKey": "WarmPoolReuseOnScaleIn", "ParameterValue": "true"}
+    ],
+    "parameters_from_outputs": [
+        {
+            "output_keys": ["SecuritySubnet1Id", "SecuritySubnet2Id", "SecuritySubnet3Id"],
+            "parameter_key": "SecuritySubnetIds"
+        },
+        {
+            "output_keys": ["GWLBSubnet1Id", "GWLBSubnet2Id", "GWLBSubnet3Id"],
+            "parameter_key": "GWLBSubnetIds"
+        },
+        {"output_key": "SecurityGroupId", "parameter_key": "SecurityGroupId"},
+        {"output_key": "GWLBTargetGroupArn", "parameter_key": "GWLBTargetGroupArn"}
     ],
     "outputs": [
         "AutoScalingGroupName",
         "LaunchTemplateId",
-        "KeyPairUsed"
+        "KeyPairUsed",
+        "WarmPoolState"
     ]
 }
 
-def wait_for_completion(stack_name, operation):
-    waiter_name = 'stack_create_complete' if operation == 'create_stack' else 'stack_update_complete'
-    waiter = cf.get_waiter(waiter_name)
-    logger.info(f"Waiting for {stack_name} to {operation.replace('_', ' ')}...")
+# --- Pipeline order ---
+stack_definitions = [
+    vpc_stack_definition,
+    security_group_stack_definition,
+    gwlb_stack_definition,
+    gwlb_endpoint_stack_definition,
+    asg_stack_definition
+]
+
+def resolve_manifest_parameter(stack_def, manifest_path):
+    """Return a parameters_from_manifest value: the root principals of the tenant accounts."""
     try:
-        waiter.wait(StackName=stack_name)
-        logger.info(f"{stack_name} {operation.replace('_', ' ')} completed successfully.")
-    except Exception as e:
-        logger.error(f"Error during stack wait: {e}")
-
-def get_stack_status(stack_name):
-    try:
-        response = cf.describe_stacks(StackName=stack_name)
-        return response['Stacks'][0]['StackStatus']
-    except ClientError as e:
-        if 'does not exist' in str(e):
-            return None
-        logger.error(f"Failed to get status of stack {stack_name}: {e}")
+        return load_tenant_principals(manifest_path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to read tenant manifest {manifest_path} for stack {stack_def['name']}: {e}")
         return None
 
-def deploy_stack(stack_def):
-    stack_name = stack_def["name"]
-    template_path = os.path.join(TEMPLATE_DIR, stack_def["template"])
-
-    if not os.path.isfile(template_path):
-        logger.error(f"Template file not found: {template_path}")
-        return False
-
-    with open(template_path, 'r') as f:
-        template_body = f.read()
-
-    try:
-        cf.validate_template(TemplateBody=template_body)
-    except ClientError as e:
-        logger.error(f"Template validation failed: {e}")
-        return False
-
-    parameters = stack_def.get("parameters", [])
-
-    # If deploying the security group stack, set the VPC ID parameter
-    if stack_name == "FortiGateSecurityGroupStack":
-        vpc_id = collected_outputs.get("VpcId")
-        if vpc_id:
-            parameters[1]["ParameterValue"] = vpc_id  # Set VPC ID
-
-    # If deploying the GWLB stack, set the VPC ID and GWLB Subnet IDs parameters
-    if stack_name == "GWLBStack":
-        vpc_id = collected_outputs.get("VpcId")
-        gwlb_subnet_ids = collected_outputs.get("GWLBSubnetIds")
-        if vpc_id:
-            parameters[1]["ParameterValue"] = vpc_id  # Set VPC ID
-        if gwlb_subnet_ids:
-            parameters[2]["ParameterValue"] = gwlb_subnet_ids  # Set GWLB Subnet IDs
-
-    # If deploying the GWLBe stack, set the VPC ID and GWLBe Subnet IDs parameters
-    if stack_name == "GWLBeStack":
-        vpc_id = collected_outputs.get("VpcId")
-        gwlb_endpoint_subnet_ids = collected_outputs.get("GWLBeSubnetIds")
-        if vpc_id:
-            parameters[1]["ParameterValue"] = vpc_id  # Set VPC ID
-        if gwlb_endpoint_subnet_ids:
-            parameters[2]["ParameterValue"] = gwlb_endpoint_subnet_ids  # Set GWLBe Subnet IDs
-
-    # If deploying the ASG stack, set the necessary parameters
-    if stack_name == "AutoScalingGroupStack":
-        security_subnet_ids = collected_outputs.get("SecuritySubnetIds")
-        gwlb_subnet_ids = collected_outputs.get("GWLBSubnetIds")
-        security_group_id = collected_outputs.get("SecurityGroupId")
-        gwlb_target_group_arn = collected_outputs.get("GWLBTargetGroupArn")
-
-        if security_subnet_ids:
-            parameters[1]["ParameterValue"] = security_subnet_ids  # Set Security Subnet IDs
-        if gwlb_subnet_ids:
-            parameters[2]["ParameterValue"] = gwlb_subnet_ids  # Set GWLB Subnet IDs
-        if security_group_id:
-            parameters[3]["ParameterValue"] = security_group_id  # Set Security Group ID
-        if gwlb_target_group_arn:
-            parameters[5]["ParameterValue"] = gwlb_target_group_arn  # Set GWLB Target Group ARN
-
-    stack_status = get_stack_status(stack_name)
-    try:
-        if not stack_status:
-            response = cf.create_stack(
-                StackName=stack_name,
-                TemplateBody=template_body,
-                Parameters=parameters,
-                Capabilities=['CAPABILITY_NAMED_IAM'],
-                DisableRollback=True
-            )
-            logger.info(f"Creating stack: {response['StackId']}")
-            wait_for_completion(stack_name, 'create_stack')
-        elif stack_status in ["CREATE_COMPLETE", "UPDATE_COMPLETE"]:
-            if not args.force:
-                logger.info(f"Stack {stack_name} already exists. Skipping (use --force to override).")
-                return True
-            cf.update_stack(
-                StackName=stack_name,
-                TemplateBody=template_body,
-                Parameters=parameters,
-                Capabilities=['CAPABILITY_NAMED_IAM']
-            )
-            logger.info(f"Updating stack {stack_name}")
-            wait_for_completion(stack_name, 'update_stack')
-        else:
-            logger.error(f"Stack {stack_name} is in unexpected state: {stack_status}")
-            return False
-        return True
-    except ClientError as e:
-        if "No updates are to be performed" in str(e):
-            logger.info(f"No updates needed for stack {stack_name}.")
-            return True
-        logger.error(f"Error deploying stack {stack_name}: {e}")
-        return False
-
-def get_stack_outputs(stack_name):
-    try:
-        response = cf.describe_stacks(StackName=stack_name)
-        return {o['OutputKey']: o['OutputValue'] for o in response['Stacks'][0].get('Outputs', [])}
-    except ClientError as e:
-        logger.error(f"Failed to get outputs for {stack_name}: {e}")
-        return {}
-
 def set_vpc_dns_attributes(vpc_id):
+    """Enable DNS support and hostnames for the VPC; return False when the attributes could not be set."""
     try:
         ec2.modify_vpc_attribute(VpcId=vpc_id, EnableDnsSupport={'Value': True})
         ec2.modify_vpc_attribute(VpcId=vpc_id, EnableDnsHostnames={'Value': True})
         logger.info(f"Enabled DNS support and hostnames for VPC {vpc_id}")
+        return True
     except ClientError as e:
         logger.error(f"Failed to modify VPC DNS attributes: {e}")
-        sys.exit(1)
+        return False
 
 def join_subnet_ids(outputs, prefix, count=3):
     """Helper to join subnet IDs for a given prefix e.g. 'PublicSubnet1Id'..'PublicSubnet3Id'"""
@@ -257,67 +210,41 @@ def join_subnet_ids(outputs, prefix, count=3):
         return None
     return ",".join(outputs[k] for k in keys)
 
-def add_vpc_endpoint_service_permission(region, target_account):
-    ec2 = boto3.client('ec2', region_name=region)
-    account_id = sts.get_caller_identity()['Account']
-
-    logger.info(f"[INFO] Scanning for VPC Endpoint Services in region: {region} (Account: {account_id})")
+# --- Service registry ---
+def get_project_name(stack_def):
+    return next(p["ParameterValue"] for p in stack_def["parameters"] if p["ParameterKey"] == "ProjectName")
 
-    paginator = ec2.get_paginator('describe_vpc_endpoint_services')
-    owned_service = None
-
-    try:
-        for page in paginator.paginate():
-            for service in page.get('ServiceDetails', []):
-                if service.get('Owner') == account_id:
-                    owned_service = service
-                    break
-            if owned_service:
-                break
-    except Exception as e:
-        logger.error(f"[ERROR] Failed to fetch services: {e}")
-        sys.exit(1)
-
-    if not owned_service:
-        logger.error("[ERROR] No VPC endpoint services owned by this account.")
-        sys.exit(1)
-
-    service_id = owned_service['ServiceId']
-    service_name = owned_service['ServiceName']
-
-    logger.info(f"[INFO] Found service: {service_name}")
-    logger.info(f"[INFO] Adding permission for account {target_account}...")
-
-    principal_arn = f"arn:aws:iam::{target_account}:root"
+def publish_service_registry(collected_outputs, registry_source="ssm"):
+    """Publish the GWLB service outputs so egress deployments can resolve them instead of hard-coding them.
 
+    Returns False when the outputs could not be published.
+    """
+    project = get_project_name(gwlb_stack_definition)
+    values = {k: collected_outputs[k] for k in REGISTRY_KEYS if k in collected_outputs}
+    if not values:
+        logger.warning("No GWLB service outputs to publish.")
+        return True
     try:
-        ec2.modify_vpc_endpoint_service_permissions(
-            ServiceId=service_id,
-            AddAllowedPrincipals=[principal_arn]
-        )
-        logger.info(f"[SUCCESS] Permission added for account {target_account} to access service.")
-        return service_id, service_name  # Return the service ID and name
-    except Exception as e:
-        logger.error(f"[ERROR] Failed to add permission: {e}")
-        sys.exit(1)
-
-if __name__ == "__main__":
-    collected_outputs = {}
+        service_registry.publish(project, values, source=registry_source)
+        return True
+    except (ClientError, OSError, ValueError) as e:
+        logger.error(f"Failed to publish service registry parameters: {e}")
+        return False
 
-    # Deploy the VPC stack
-    success = deploy_stack(vpc_stack_definition)
-    if not success:
-        logger.error("Aborting due to failed VPC stack deployment.")
-        sys.exit(1)
+def build_pipeline(manifest_path=TENANT_MANIFEST, registry_source="ssm", force=False, execute=False):
+    """Return the perimeter pipeline; reconcile.py builds its own with force=True."""
+    def after_stack(stack_def, collected_outputs):
+        if stack_def is gwlb_stack_definition and not publish_service_registry(collected_outputs, registry_source):
+            sys.exit(1)
 
-    # Collect outputs from the VPC stack
-    outputs = get_stack_outputs(vpc_stack_definition["name"])
-    for key in vpc_stack_definition.get("outputs", []):
-        if key in outputs:
-            collected_outputs[key] = outputs[key]
-        else:
-            logger.warning(f"Output '{key}' not found in {vpc_stack_definition['name']}")
+    return change_sets.Pipeline(
+        cf, stack_definitions, template_dir=TEMPLATE_DIR,
+        parameter_sources={"parameters_from_manifest": lambda d, p: resolve_manifest_parameter(d, manifest_path)},
+        after_stack=after_stack, force=force, execute=execute
+    )
 
+def post_deploy(collected_outputs, manifest_path=TENANT_MANIFEST):
+    """Steps that follow a completed pipeline, whether it ran through deploy_stack or change sets."""
     # Join subnet IDs into comma-separated strings for easy reference
     subnet_groups = {
         "PublicSubnetIds": "PublicSubnet",
@@ -335,92 +262,27 @@ if __name__ == "__main__":
         else:
             logger.warning(f"Could not join subnet IDs for {joined_key}")
 
-    # Deploy the Security Group stack
-    success = deploy_stack(security_group_stack_definition)
-    if not success:
-        logger.error("Aborting due to failed Security Group stack deployment.")
-        sys.exit(1)
-
-    # Collect outputs from the Security Group stack
-    outputs = get_stack_outputs(security_group_stack_definition["name"])
-    for key in security_group_stack_definition.get("outputs", []):
-        if key in outputs:
-            collected_outputs[key] = outputs[key]
-        else:
-            logger.warning(f"Output '{key}' not found in {security_group_stack_definition['name']}")
-
-    # Deploy the GWLB stack
-    success = deploy_stack(gwlb_stack_definition)
-    if not success:
-        logger.error("Aborting due to failed GWLB stack deployment.")
+    # Enable DNS attributes for the VPC
+    if not set_vpc_dns_attributes(collected_outputs["VpcId"]):
         sys.exit(1)
+    logger.info("\n--- Completed all CloudFormation stack deployments ---")
+    logger.info(f"Endpoint service permissions are managed by {gwlb_stack_definition['name']} from {manifest_path}")
 
-    # Collect outputs from the GWLB stack
-    outputs = get_stack_outputs(gwlb_stack_definition["name"])
-    for key in gwlb_stack_definition.get("outputs", []):
-        if key in outputs:
-            collected_outputs[key] = outputs[key]
-        else:
-            logger.warning(f"Output '{key}' not found in {gwlb_stack_definition['name']}")
-
-# Deploy the GWLBe stack
-success = deploy_stack(gwlb_endpoint_stack_definition)
-if not success:
-    logger.error("Aborting due to failed GWLBe stack deployment.")
-    sys.exit(1)
-
-# Collect outputs from the GWLBe stack
-outputs = get_stack_outputs(gwlb_endpoint_stack_definition["name"])
-for key in gwlb_endpoint_stack_definition.get("outputs", []):
-    if key in outputs:
-        collected_outputs[key] = outputs[key]
-    else:
-        logger.warning(f"Output '{key}' not found in {gwlb_endpoint_stack_definition['name']}")
+def main():
+    args = parser.parse_args()
+    log_pipeline.setup_logging("deployment.log")
+    pipeline = build_pipeline(args.manifest, args.registry, force=args.force, execute=args.execute)
 
-# Log details about the GWLBe endpoint and permissions
-gwlbe_service_id = collected_outputs.get("GWLBeServiceId")  # Assuming you have this output
-gwlbe_service_name = collected_outputs.get("GWLBeServiceName")  # Assuming you have this output
-target_account_id = "975050199901"  # Replace with the actual target account ID
+    if not args.skip_preflight:
+        _, known_outputs = pipeline.get_known_outputs()
+        if not preflight.run(ec2, stack_definitions, known_outputs):
+            logger.error("Aborting: pre-flight validation failed, no stack was submitted.")
+            sys.exit(1)
 
-if gwlbe_service_id and gwlbe_service_name:
-    logger.info("Preparing to add cross-account permissions for GWLBe endpoint:")
-    logger.info("----------------------------------------------------------")
-    logger.info(f"  Service ID:         {gwlbe_service_id}")
-    logger.info(f"  Service Name:       {gwlbe_service_name}")
-    logger.info(f"  Target Account ID:  {target_account_id}")
-    logger.info("----------------------------------------------------------")
+    ok, collected_outputs = pipeline.run(plan=args.plan)
+    if collected_outputs is None:
+        sys.exit(0 if ok else 1)
+    post_deploy(collected_outputs, args.manifest)
 
-# Deploy the Auto Scaling Group stack
-asg_stack_definition["parameters"][1]["ParameterValue"] = collected_outputs.get("SecuritySubnetIds", "")
-asg_stack_definition["parameters"][2]["ParameterValue"] = collected_outputs.get("GWLBSubnetIds", "")
-asg_stack_definition["parameters"][3]["ParameterValue"] = collected_outputs.get("SecurityGroupId", "")
-asg_stack_definition["parameters"][5]["ParameterValue"] = collected_outputs.get("GWLBTargetGroupArn", "")
-success = deploy_stack(asg_stack_definition)
-if not success:
-    logger.error("Aborting due to failed Auto Scaling Group stack deployment.")
-    sys.exit(1)
-
-# Enable DNS attributes for the VPC
-set_vpc_dns_attributes(collected_outputs["VpcId"])
-logger.info("\n--- Completed all CloudFormation stack deployments ---")
-
-# --- Run external script to add VPC Endpoint Service Permission ---
-try:
-    result = subprocess.run(
-        ["python", "Add-VPCEndpointServicePermission.py"],
-        capture_output=True,
-        text=True,
-        check=True
-    )
-    logger.info("[Add-VPCEndpointServicePermission.py] Output:")
-    logger.info("----------------------------------------------------------")
-    logger.info(result.stdout)
-    if result.stderr:
-        logger.warning("[Add-VPCEndpointServicePermission.py] Errors:")
-        logger.warning(result.stderr)
-    logger.info("----------------------------------------------------------")
-except subprocess.CalledProcessError as e:
-    logger.error(f"Error running Add-VPCEndpointServicePermission.py: {e}")
-    logger.error(f"Stdout: {e.stdout}")
-    logger.error(f"Stderr: {e.stderr}")
-    sys.exit(1)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+import boto3
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import log_pipeline
+
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+DEFAULT_DB = "inventory.db"
+TENANT_MANIFEST = os.path.join("parameters", "tenant-manifest.json")
+MAX_WORKERS = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stacks (
+    account_id TEXT, region TEXT, name TEXT, status TEXT, last_event_id TEXT, refreshed_at REAL,
+    PRIMARY KEY (account_id, region, name)
+);
+CREATE TABLE IF NOT EXISTS stack_outputs (
+    account_id TEXT, region TEXT, stack_name TEXT, output_key TEXT, output_value TEXT,
+    PRIMARY KEY (account_id, region, stack_name, output_key)
+);
+CREATE INDEX IF NOT EXISTS idx_stack_outputs_value ON stack_outputs (output_value);
+CREATE TABLE IF NOT EXISTS stack_resources (
+    account_id TEXT, region TEXT, stack_name TEXT, logical_id TEXT, physical_id TEXT, resource_type TEXT,
+    PRIMARY KEY (account_id, region, stack_name, logical_id)
+);
+CREATE INDEX IF NOT EXISTS idx_stack_resources_physical ON stack_resources (physical_id);
+CREATE TABLE IF NOT EXISTS vpcs (
+    vpc_id TEXT PRIMARY KEY, account_id TEXT, region TEXT, cidr TEXT, name TEXT
+);
+CREATE TABLE IF NOT EXISTS subnets (
+    subnet_id TEXT PRIMARY KEY, vpc_id TEXT, account_id TEXT, region TEXT, az TEXT, az_id TEXT, cidr TEXT, name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_subnets_vpc ON subnets (vpc_id);
+CREATE INDEX IF NOT EXISTS idx_subnets_az ON subnets (az);
+CREATE INDEX IF NOT EXISTS idx_subnets_az_id ON subnets (az_id);
+CREATE TABLE IF NOT EXISTS route_tables (
+    route_table_id TEXT PRIMARY KEY, vpc_id TEXT, account_id TEXT, region TEXT, main INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_route_tables_vpc ON route_tables (vpc_id);
+CREATE TABLE IF NOT EXISTS route_table_subnets (
+    subnet_id TEXT PRIMARY KEY, route_table_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_route_table_subnets_table ON route_table_subnets (route_table_id);
+CREATE TABLE IF NOT EXISTS routes (
+    route_table_id TEXT, destination TEXT, target TEXT, state TEXT,
+    PRIMARY KEY (route_table_id, destination)
+);
+CREATE INDEX IF NOT EXISTS idx_routes_target ON routes (target);
+CREATE TABLE IF NOT EXISTS vpc_endpoints (
+    endpoint_id TEXT PRIMARY KEY, vpc_id TEXT, account_id TEXT, region TEXT, service_name TEXT, subnet_id TEXT, state TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_vpc_endpoints_service ON vpc_endpoints (service_name);
+CREATE INDEX IF NOT EXISTS idx_vpc_endpoints_subnet ON vpc_endpoints (subnet_id);
+CREATE TABLE IF NOT EXISTS nat_gateways (
+    nat_gateway_id TEXT PRIMARY KEY, vpc_id TEXT, account_id TEXT, region TEXT, subnet_id TEXT, state TEXT
+);
+CREATE TABLE IF NOT EXISTS target_groups (
+    arn TEXT PRIMARY KEY, account_id TEXT, region TEXT, name TEXT, protocol TEXT, vpc_id TEXT
+);
+CREATE TABLE IF NOT EXISTS targets (
+    target_group_arn TEXT, target_id TEXT, az TEXT, health TEXT, az_id TEXT,
+    PRIMARY KEY (target_group_arn, target_id)
+);
+CREATE TABLE IF NOT EXISTS endpoint_services (
+    service_id TEXT PRIMARY KEY, account_id TEXT, region TEXT, service_name TEXT, acceptance_required INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_endpoint_services_name ON endpoint_services (service_name);
+CREATE TABLE IF NOT EXISTS service_principals (
+    service_id TEXT, principal TEXT,
+    PRIMARY KEY (service_id, principal)
+);
+CREATE TABLE IF NOT EXISTS endpoint_connections (
+    service_id TEXT, endpoint_id TEXT, owner_id TEXT, state TEXT,
+    PRIMARY KEY (service_id, endpoint_id)
+);
+CREATE INDEX IF NOT EXISTS idx_endpoint_connections_owner ON endpoint_connections (owner_id);
+"""
+
+QUERIES = {
+    # Tenant VPCs whose routes point at a GWLB endpoint in the given AZ (name, ID or zone letter)
+    "tenants-by-az": """
+        SELECT DISTINCT v.account_id, rt.vpc_id, s.az, s.az_id, e.endpoint_id, r.route_table_id, r.destination
+        FROM routes r
+        JOIN vpc_endpoints e ON e.endpoint_id = r.target
+        JOIN subnets s ON s.subnet_id = e.subnet_id
+        JOIN route_tables rt ON rt.route_table_id = r.route_table_id
+        JOIN vpcs v ON v.vpc_id = rt.vpc_id
+        WHERE s.az = :arg OR s.az_id = :arg OR substr(s.az, -1) = :arg
+        ORDER BY v.account_id, rt.vpc_id, r.route_table_id
+    """,
+    # Endpoints of a service (name or ID), seen from the tenant accounts and from the service side
+    "endpoints-by-service": """
+        SELECT e.endpoint_id, e.account_id, e.vpc_id, s.az, e.state, 'endpoint' AS source
+        FROM vpc_endpoints e
+        LEFT JOIN subnets s ON s.subnet_id = e.subnet_id
+        WHERE e.service_name = :arg
+           OR e.service_name IN (SELECT service_name FROM endpoint_services WHERE service_id = :arg)
+        UNION
+        SELECT c.endpoint_id, c.owner_id, NULL, NULL, c.state, 'connection' AS source
+        FROM endpoint_connections c
+        WHERE c.service_id = :arg
+           OR c.service_id IN (SELECT service_id FROM endpoint_services WHERE service_name = :arg)
+        ORDER BY 2, 1
+    """,
+    # Principals allowed on each endpoint service
+    "service-principals": """
+        SELECT es.service_id, es.service_name, es.acceptance_required, p.principal
+        FROM endpoint_services es
+        LEFT JOIN service_principals p ON p.service_id = es.service_id
+        WHERE :arg = '' OR es.service_id = :arg OR es.service_name = :arg
+        ORDER BY es.service_id, p.principal
+    """,
+    # Appliance health per AZ of the GWLB target groups
+    "targets-by-az": """
+        SELECT tg.name, t.az, t.az_id, t.health, COUNT(*) AS targets
+        FROM targets t
+        JOIN target_groups tg ON tg.arn = t.target_group_arn
+        WHERE :arg = '' OR t.az = :arg OR t.az_id = :arg
+        GROUP BY tg.name, t.az, t.az_id, t.health
+        ORDER BY tg.name, t.az
+    """,
+    "stacks": """
+        SELECT account_id, region, name, status, datetime(refreshed_at, 'unixepoch') AS refreshed
+        FROM stacks
+        WHERE :arg = '' OR name = :arg
+        ORDER BY account_id, region, name
+    """
+}
+
+# --- Argument parsing ---
+parser = argparse.ArgumentParser(description="Snapshot the inspection fleet into a local SQLite inventory and query it.")
+parser.add_argument('--db', default=DEFAULT_DB, help='SQLite inventory file.')
+subparsers = parser.add_subparsers(dest='command', required=True)
+for name, help_text in (("snapshot", "Replace the inventory of each account with a full bulk snapshot."),
+                        ("refresh", "Re-read what belongs to stacks with new stack events, and all target health.")):
+    sub = subparsers.add_parser(name, help=help_text)
+    sub.add_argument('--region', default="ap-southeast-1", help='Region to snapshot.')
+    sub.add_argument('--profile', action='append', dest='profiles',
+                     help='AWS profile of an account to include (repeatable; default: current credentials).')
+query_parser = subparsers.add_parser('query', help='Answer a stored query from the local inventory.')
+query_parser.add_argument('name', choices=sorted(QUERIES) + ["sql"], help="Stored query, or 'sql' for a read-only ad-hoc statement.")
+query_parser.add_argument('arg', nargs='?', default='', help='Query argument (AZ, service name/ID, stack name or SQL).')
+query_parser.add_argument('--manifest', default=TENANT_MANIFEST, help='Tenant manifest used to name accounts.')
+query_parser.add_argument('--json', action='store_true', help='Print rows as JSON.')
+
+# --- Database ---
+def open_db(path, read_only=False):
+    if read_only:
+        if not os.path.isfile(path):
+            logger.error(f"Inventory {path} does not exist; run 'inventory.py snapshot' first.")
+            sys.exit(1)
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    else:
+        db = sqlite3.connect(path)
+        db.executescript(SCHEMA)
+        # Inventories created before targets.az_id existed
+        if "az_id" not in {c[1] for c in db.execute("PRAGMA table_info(targets)")}:
+            db.execute("ALTER TABLE targets ADD COLUMN az_id TEXT")
+    db.row_factory = sqlite3.Row
+    return db
+
+def name_tag(resource):
+    return next((t["Value"] for t in resource.get("Tags", []) if t["Key"] == "Name"), "")
+
+# --- Bulk describe passes ---
+def paginate(client, operation, result_key, **kwargs):
+    items = []
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        items.extend(page.get(result_key, []))
+    return items
+
+def fetch_stack_details(cf, stack_name):
+    """Newest event ID and resources of one stack."""
+    events = cf.describe_stack_events(StackName=stack_name)['StackEvents']
+    resources = paginate(cf, 'list_stack_resources', 'StackResourceSummaries', StackName=stack_name)
+    return (events[0]['EventId'] if events else None), resources
+
+def fetch_stacks(cf, pool, only=None):
+    """Describe all stacks in one paginated pass, then their events and resources concurrently."""
+    stacks = [s for s in paginate(cf, 'describe_stacks', 'Stacks') if only is None or s['StackName'] in only]
+    details = pool.map(lambda s: fetch_stack_details(cf, s['StackName']), stacks)
+    return [(stack, event_id, resources) for stack, (event_id, resources) in zip(stacks, details)]
+
+def fetch_network(ec2, pool, vpc_ids=None):
+    """Describe VPCs, subnets, route tables, GWLB endpoints and NAT gateways concurrently, optionally for some VPCs only."""
+    vpc_filter = [{"Name": "vpc-id", "Values": sorted(vpc_ids)}] if vpc_ids else []
+    futures = {
+        "vpcs": pool.submit(paginate, ec2, 'describe_vpcs', 'Vpcs', Filters=vpc_filter),
+        "subnets": pool.submit(paginate, ec2, 'describe_subnets', 'Subnets', Filters=vpc_filter),
+        "route_tables": pool.submit(paginate, ec2, 'describe_route_tables', 'RouteTables', Filters=vpc_filter),
+        "endpoints": pool.submit(paginate, ec2, 'describe_vpc_endpoints', 'VpcEndpoints',
+                                 Filters=vpc_filter + [{"Name": "vpc-endpoint-type", "Values": ["GatewayLoadBalancer"]}]),
+        "nat_gateways": pool.submit(paginate, ec2, 'describe_nat_gateways', 'NatGateways',
+                                    Filter=vpc_filter + [{"Name": "state", "Values": ["available"]}])
+    }
+    return {key: future.result() for key, future in futures.items()}
+
+def fetch_services(ec2, pool):
+    """Describe the endpoint services owned by the account with their principals and connections."""
+    services = paginate(ec2, 'describe_vpc_endpoint_service_configurations', 'ServiceConfigurations')
+
+    def details(service):
+        service_id = service['ServiceId']
+        principals = paginate(ec2, 'describe_vpc_endpoint_service_permissions', 'AllowedPrincipals', ServiceId=service_id)
+        connections = paginate(ec2, 'describe_vpc_endpoint_connections', 'VpcEndpointConnections',
+                               Filters=[{"Name": "service-id", "Values": [service_id]}])
+        return principals, connections
+
+    return [(service, principals, connections) for service, (principals, connections) in zip(services, pool.map(details, services))]
+
+def fetch_target_groups(elbv2, ec2, pool):
+    """Describe the GWLB (GENEVE) target groups, the health of their targets and each target's AZ.
+
+    describe_target_health has no AZ for instance targets, so their AZ comes from describe_instances.
+    Returns the groups with their health and {target_id: (az, az_id)}.
+    """
+    groups = [g for g in paginate(elbv2, 'describe_target_groups', 'TargetGroups') if g['Protocol'] == 'GENEVE']
+    f_zones = pool.submit(ec2.describe_availability_zones)
+    health = list(pool.map(lambda g: elbv2.describe_target_health(TargetGroupArn=g['TargetGroupArn'])['TargetHealthDescriptions'], groups))
+    zone_ids = {z['ZoneName']: z['ZoneId'] for z in f_zones.result()['AvailabilityZones']}
+
+    target_azs = {h['Target']['Id']: h['Target'].get('AvailabilityZone') for descriptions in health for h in descriptions}
+    instance_ids = sorted(t for t, az in target_azs.items() if az is None and t.startswith("i-"))
+    for i in range(0, len(instance_ids), 200):
+        chunk = instance_ids[i:i + 200]
+        for reservation in paginate(ec2, 'describe_instances', 'Reservations',
+                                    Filters=[{"Name": "instance-id", "Values": chunk}]):
+            for instance in reservation['Instances']:
+                target_azs[instance['InstanceId']] = instance['Placement']['AvailabilityZone']
+    # IP targets outside the load balancer's VPC report the AZ "all", which has no AZ ID
+    locations = {t: (az, zone_ids.get(az)) for t, az in target_azs.items()}
+    return list(zip(groups, health)), locations
+
+# --- Writers (each replaces the rows of its scope) ---
+def write_stacks(db, account, region, stacks, replace_all):
+    now = time.time()
+    if replace_all:
+        for table in ("stacks", "stack_outputs", "stack_resources"):
+            db.execute(f"DELETE FROM {table} WHERE account_id = ? AND region = ?", (account, region))
+    for stack, event_id, resources in stacks:
+        name = stack['StackName']
+        db.execute("DELETE FROM stack_outputs WHERE account_id = ? AND region = ? AND stack_name = ?", (account, region, name))
+        db.execute("DELETE FROM stack_resources WHERE account_id = ? AND region = ? AND stack_name = ?", (account, region, name))
+        db.execute("INSERT OR REPLACE INTO stacks VALUES (?, ?, ?, ?, ?, ?)",
+                   (account, region, name, stack['StackStatus'], event_id, now))
+        db.executemany("INSERT INTO stack_outputs VALUES (?, ?, ?, ?, ?)",
+                       [(account, region, name, o['OutputKey'], o['OutputValue']) for o in stack.get('Outputs', [])])
+        db.executemany("INSERT INTO stack_resources VALUES (?, ?, ?, ?, ?, ?)",
+                       [(account, region, name, r['LogicalResourceId'], r.get('PhysicalResourceId'), r['ResourceType'])
+                        for r in resources])
+
+def delete_stacks(db, account, region, names):
+    for table, column in (("stacks", "name"), ("stack_outputs", "stack_name"), ("stack_resources", "stack_name")):
+        db.executemany(f"DELETE FROM {table} WHERE account_id = ? AND region = ? AND {column} = ?",
+                       [(account, region, n) for n in names])
+
+def write_network(db, account, region, network, vpc_ids=None):
+    scope = "account_id = ? AND region = ?"
+    params = [account, region]
+    if vpc_ids:
+        scope += f" AND vpc_id IN ({','.join('?' * len(vpc_ids))})"
+        params += sorted(vpc_ids)
+    tables = f"SELECT route_table_id FROM route_tables WHERE {scope}"
+    db.execute(f"DELETE FROM routes WHERE route_table_id IN ({tables})", params)
+    db.execute(f"DELETE FROM route_table_subnets WHERE route_table_id IN ({tables})", params)
+    for table in ("route_tables", "subnets", "vpc_endpoints", "nat_gateways", "vpcs"):
+        db.execute(f"DELETE FROM {table} WHERE {scope}", params)
+
+    db.executemany("INSERT OR REPLACE INTO vpcs VALUES (?, ?, ?, ?, ?)", [
+        (v['VpcId'], account, region, v['CidrBlock'], name_tag(v)) for v in network["vpcs"]
+    ])
+    db.executemany("INSERT OR REPLACE INTO subnets VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+        (s['SubnetId'], s['VpcId'], account, region, s['AvailabilityZone'], s.get('AvailabilityZoneId'),
+         s['CidrBlock'], name_tag(s)) for s in network["subnets"]
+    ])
+    for table in network["route_tables"]:
+        associations = table.get('Associations', [])
+        db.execute("INSERT OR REPLACE INTO route_tables VALUES (?, ?, ?, ?, ?)", (
+            table['RouteTableId'], table['VpcId'], account, region, int(any(a.get('Main') for a in associations))
+        ))
+        db.executemany("INSERT OR REPLACE INTO route_table_subnets VALUES (?, ?)", [
+            (a['SubnetId'], table['RouteTableId']) for a in associations if a.get('SubnetId')
+        ])
+        db.executemany("INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?)", [
+            (table['RouteTableId'], r.get('DestinationCidrBlock') or r.get('DestinationPrefixListId'),
+             next((r[k] for k in ("VpcEndpointId", "NatGatewayId", "TransitGatewayId", "GatewayId",
+                                  "NetworkInterfaceId", "VpcPeeringConnectionId") if r.get(k)), None),
+             r.get('State'))
+            for r in table.get('Routes', []) if r.get('DestinationCidrBlock') or r.get('DestinationPrefixListId')
+        ])
+    db.executemany("INSERT OR REPLACE INTO vpc_endpoints VALUES (?, ?, ?, ?, ?, ?, ?)", [
+        (e['VpcEndpointId'], e['VpcId'], account, region, e['ServiceName'],
+         e['SubnetIds'][0] if e.get('SubnetIds') else None, e['State']) for e in network["endpoints"]
+    ])
+    db.executemany("INSERT OR REPLACE INTO nat_gateways VALUES (?, ?, ?, ?, ?, ?)", [
+        (n['NatGatewayId'], n['VpcId'], account, region, n['SubnetId'], n['State']) for n in network["nat_gateways"]
+    ])
+
+def write_services(db, account, region, services):
+    owned = "SELECT service_id FROM endpoint_services WHERE account_id = ? AND region = ?"
+    db.execute(f"DELETE FROM service_principals WHERE service_id IN ({owned})", (account, region))
+    db.execute(f"DELETE FROM endpoint_connections WHERE service_id IN ({owned})", (account, region))
+    db.execute("DELETE FROM endpoint_services WHERE account_id = ? AND region = ?", (account, region))
+    for service, principals, connections in services:
+        service_id = service['ServiceId']
+        db.execute("INSERT OR REPLACE INTO endpoint_services VALUES (?, ?, ?, ?, ?)", (
+            service_id, account, region, service.get('ServiceName'), int(service.get('AcceptanceRequired', False))
+        ))
+        db.executemany("INSERT OR REPLACE INTO service_principals VALUES (?, ?)",
+                       [(service_id, p['Principal']) for p in principals])
+        db.executemany("INSERT OR REPLACE INTO endpoint_connections VALUES (?, ?, ?, ?)", [
+            (service_id, c['VpcEndpointId'], c['VpcEndpointOwner'], c['VpcEndpointState']) for c in connections
+        ])
+
+def write_target_groups(db, account, region, target_groups):
+    target_groups, locations = target_groups
+    owned = "SELECT arn FROM target_groups WHERE account_id = ? AND region = ?"
+    db.execute(f"DELETE FROM targets WHERE target_group_arn IN ({owned})", (account, region))
+    db.execute("DELETE FROM target_groups WHERE account_id = ? AND region = ?", (account, region))
+    for group, health in target_groups:
+        arn = group['TargetGroupArn']
+        db.execute("INSERT OR REPLACE INTO target_groups VALUES (?, ?, ?, ?, ?, ?)",
+                   (arn, account, region, group['TargetGroupName'], group['Protocol'], group.get('VpcId')))
+        rows = []
+        for h in health:
+            az, az_id = locations.get(h['Target']['Id'], (None, None))
+            rows.append((arn, h['Target']['Id'], az, h['TargetHealth']['State'], az_id))
+        db.executemany("INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?)", rows)
+
+# --- Snapshot and incremental refresh ---
+def account_clients(profile, region):
+    session = boto3.Session(profile_name=profile, region_name=region)
+    account = session.client('sts').get_caller_identity()['Account']
+    return account, session.client('cloudformation'), session.client('ec2'), session.client('elbv2')
+
+def snapshot(db, profile, region):
+    account, cf, ec2, elbv2 = account_clients(profile, region)
+    started = time.monotonic()
+    # The four passes fan out their per-item calls on the same pool; they occupy at most half of it
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        f_stacks = pool.submit(fetch_stacks, cf, pool)
+        f_network = pool.submit(fetch_network, ec2, pool)
+        f_services = pool.submit(fetch_services, ec2, pool)
+        f_groups = pool.submit(fetch_target_groups, elbv2, ec2, pool)
+        stacks, network = f_stacks.result(), f_network.result()
+        services, target_groups = f_services.result(), f_groups.result()
+
+    with db:
+        write_stacks(db, account, region, stacks, replace_all=True)
+        write_network(db, account, region, network)
+        write_services(db, account, region, services)
+        write_target_groups(db, account, region, target_groups)
+    logger.info(f"[{account}/{region}] Snapshot of {len(stacks)} stack(s), {len(network['vpcs'])} VPC(s), "
+                f"{len(network['endpoints'])} GWLB endpoint(s), {len(services)} endpoint service(s) and "
+                f"{len(target_groups[0])} target group(s) in {time.monotonic() - started:.1f}s")
+
+def affected_vpcs(db, account, region, stack_names):
+    """VPCs that contain any resource of the given stacks, according to the stored inventory."""
+    placeholders = ','.join('?' * len(stack_names))
+    rows = db.execute(f"""
+        SELECT physical_id FROM stack_resources
+        WHERE account_id = ? AND region = ? AND stack_name IN ({placeholders})
+    """, [account, region, *stack_names]).fetchall()
+    ids = [r['physical_id'] for r in rows if r['physical_id']]
+    vpc_ids = {i for i in ids if i.startswith("vpc-")}
+    for table, column in (("subnets", "subnet_id"), ("route_tables", "route_table_id"), ("vpc_endpoints", "endpoint_id")):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            vpc_ids.update(r['vpc_id'] for r in db.execute(
+                f"SELECT vpc_id FROM {table} WHERE {column} IN ({','.join('?' * len(chunk))})", chunk))
+    return vpc_ids
+
+def changed_resource_types(db, account, region, stack_names):
+    placeholders = ','.join('?' * len(stack_names))
+    return {r['resource_type'] for r in db.execute(f"""
+        SELECT DISTINCT resource_type FROM stack_resources
+        WHERE account_id = ? AND region = ? AND stack_name IN ({placeholders})
+    """, [account, region, *stack_names])}
+
+def refresh(db, profile, region):
+    """Poll the newest stack event of every stack and re-read only what changed since the last pass.
+
+    Target health changes without stack events, so the GWLB target groups are re-read on every pass.
+    """
+    account, cf, ec2, elbv2 = account_clients(profile, region)
+    known = {r['name']: r['last_event_id'] for r in db.execute(
+        "SELECT name, last_event_id FROM stacks WHERE account_id = ? AND region = ?", (account, region))}
+    if not known:
+        logger.info(f"[{account}/{region}] Not in the inventory yet; taking a full snapshot.")
+        return snapshot(db, profile, region)
+
+    current = [s['StackName'] for s in paginate(cf, 'describe_stacks', 'Stacks')]
+
+    def newest_event(name):
+        events = cf.describe_stack_events(StackName=name)['StackEvents']
+        return events[0]['EventId'] if events else None
+
+    vpc_ids, network, services = set(), None, None
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        f_groups = pool.submit(fetch_target_groups, elbv2, ec2, pool)
+        latest = dict(zip(current, pool.map(newest_event, current)))
+        changed = {name for name, event_id in latest.items() if known.get(name) != event_id}
+        deleted = set(known) - set(current)
+
+        if changed or deleted:
+            # Resources of the changed stacks before and after the change decide what is re-read
+            before_vpcs = affected_vpcs(db, account, region, changed | deleted)
+            before_types = changed_resource_types(db, account, region, changed | deleted)
+            stacks = fetch_stacks(cf, pool, only=changed)
+            with db:
+                delete_stacks(db, account, region, deleted)
+                write_stacks(db, account, region, stacks, replace_all=False)
+            vpc_ids = before_vpcs | affected_vpcs(db, account, region, changed)
+            types = before_types | changed_resource_types(db, account, region, changed)
+
+            network = fetch_network(ec2, pool, vpc_ids) if vpc_ids else None
+            if any(t.startswith("AWS::EC2::VPCEndpointService") for t in types):
+                services = fetch_services(ec2, pool)
+        target_groups = f_groups.result()
+
+    with db:
+        if network is not None:
+            write_network(db, account, region, network, vpc_ids)
+        if services is not None:
+            write_services(db, account, region, services)
+        write_target_groups(db, account, region, target_groups)
+    if not changed and not deleted:
+        logger.info(f"[{account}/{region}] Stacks up to date ({len(current)} checked); re-read target health.")
+        return
+    logger.info(f"[{account}/{region}] Refreshed {len(changed)} changed and removed {len(deleted)} deleted stack(s); "
+                f"re-read {len(vpc_ids)} VPC(s)" + (", endpoint services" if services is not None else "")
+                + " and target health")
+
+# --- Queries ---
+def load_tenant_names(manifest_path):
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return {t["account_id"]: t["name"] for t in json.load(f).get("tenants", [])}
+
+def run_query(db, name, arg):
+    if name == "sql":
+        return db.execute(arg).fetchall()
+    return db.execute(QUERIES[name], {"arg": arg}).fetchall()
+
+def print_rows(rows, tenants, as_json):
+    records = []
+    for row in rows:
+        record = dict(row)
+        for key in ("account_id", "owner_id"):
+            if key in record and record[key] in tenants:
+                record["tenant"] = tenants[record[key]]
+        records.append(record)
+    if as_json:
+        print(json.dumps(records, indent=2))
+        return
+    if not records:
+        print("(no rows)")
+        return
+    columns = list(dict.fromkeys(c for r in records for c in r))
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in records)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for record in records:
+        print("  ".join(str(record.get(c, "")).ljust(widths[c]) for c in columns))
+
+def main():
+    args = parser.parse_args()
+    log_pipeline.setup_logging("inventory.log")
+    if args.command == "query":
+        db = open_db(args.db, read_only=True)
+        started = time.perf_counter()
+        try:
+            rows = run_query(db, args.name, args.arg)
+        except sqlite3.Error as e:
+            logger.error(f"Query failed: {e}")
+            sys.exit(1)
+        print_rows(rows, load_tenant_names(args.manifest), args.json)
+        logger.debug(f"{len(rows)} row(s) in {(time.perf_counter() - started) * 1000:.1f} ms")
+        sys.exit(0)
+
+    db = open_db(args.db)
+    action = snapshot if args.command == "snapshot" else refresh
+    for profile in args.profiles or [None]:
+        try:
+            action(db, profile, args.region)
+        except ClientError as e:
+            logger.error(f"[{profile or 'default'}] {args.command} failed: {e}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError, BotoCoreError
+
+# Modules shared by both setups live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import change_sets
+import deployment
+import log_pipeline
+from deployment import cf, stack_definitions
+
+# --- Logging setup ---
+log_pipeline.setup_logging("reconcile.log")
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+ROUTE_VERIFIER = os.path.join("..", "egress_security_setup", "verify_route_topology.py")
+FAILED_SUFFIXES = ("_FAILED", "ROLLBACK_COMPLETE")
+IN_PROGRESS_SUFFIX = "_IN_PROGRESS"
+COMPLETE_SUFFIX = "_COMPLETE"
+
+# --- Argument parsing ---
+parser = argparse.ArgumentParser(description="Keep the perimeter stacks and tenant routes converged.")
+parser.add_argument('--interval', type=int, default=10, help='Seconds between reconcile passes.')
+parser.add_argument('--route-interval', type=int, default=300, help='Seconds between route checks of tenant VPCs.')
+parser.add_argument('--manifest', default=deployment.TENANT_MANIFEST,
+                    help='Tenant manifest with account IDs and optional vpc_ids, profile and region.')
+parser.add_argument('--region', default="ap-southeast-1", help='Region of tenant VPCs whose manifest entry has no "region".')
+parser.add_argument('--registry', default='ssm', help="Where to publish the GWLB service outputs after GWLBStack changes: 'ssm' or 'file:<path>'.")
+parser.add_argument('--once', action='store_true', help='Run a single reconcile pass and exit.')
+parser.add_argument('--dry-run', action='store_true', help='Log the actions that would be taken without applying them.')
+args = parser.parse_args()
+
+# Reconcile decides itself when an update is needed, so existing stacks must not be skipped.
+# AllowedPrincipals of the GWLB stack is resolved from the same manifest.
+pipeline = deployment.build_pipeline(args.manifest, args.registry, force=True)
+
+
+class FleetState:
+    """In-memory desired and actual state, refreshed incrementally between passes."""
+
+    def __init__(self):
+        self.templates = {}  # template file -> (mtime, sha256)
+        self.manifest_mtime = None
+        self.tenants = []
+        self.stacks = {}  # stack name -> describe_stacks entry
+        self.template_hashes = {}  # stack name -> sha256 of the deployed template
+        self.last_event = {}  # stack name -> newest EventId seen
+        self.dirty = {d["name"] for d in stack_definitions}  # stacks whose actual state must be re-read
+        self.started = set()  # stacks whose operation reconcile started; post-deploy steps pending
+        self.last_route_check = 0
+
+    # --- Desired state ---
+    def local_template_hash(self, stack_def):
+        path = os.path.join(deployment.TEMPLATE_DIR, stack_def["template"])
+        mtime = os.path.getmtime(path)
+        cached = self.templates.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'rb') as f:
+                cached = (mtime, hashlib.sha256(f.read()).hexdigest())
+            self.templates[path] = cached
+        return cached[1]
+
+    def refresh_manifest(self):
+        """Reload the tenant manifest when it changed; return True on change."""
+        mtime = os.path.getmtime(args.manifest)
+        if mtime == self.manifest_mtime:
+            return False
+        with open(args.manifest, 'r') as f:
+            self.tenants = json.load(f).get("tenants", [])
+        self.manifest_mtime = mtime
+        logger.info(f"Loaded {len(self.tenants)} tenant(s) from {args.manifest}")
+        return True
+
+    # --- Actual state ---
+    def poll_events(self, stack_name):
+        """Return True when the stack has events newer than the last one seen."""
+        try:
+            events = cf.describe_stack_events(StackName=stack_name)['StackEvents']
+        except ClientError as e:
+            if 'does not exist' in str(e):
+                return stack_name in self.stacks
+            raise
+        if not events or events[0]['EventId'] == self.last_event.get(stack_name):
+            return False
+        seen = self.last_event.get(stack_name)
+        log = log_pipeline.context_logger(logger, stack=stack_name, phase="events")
+        for event in events:
+            if event['EventId'] == seen:
+                break
+            if seen is not None:
+                log.info(f"{event['LogicalResourceId']} {event['ResourceStatus']} "
+                         f"{event.get('ResourceStatusReason', '')}".rstrip())
+        self.last_event[stack_name] = events[0]['EventId']
+        return True
+
+    def refresh_stack(self, stack_name):
+        try:
+            stack = cf.describe_stacks(StackName=stack_name)['Stacks'][0]
+        except ClientError as e:
+            if 'does not exist' in str(e):
+                self.stacks.pop(stack_name, None)
+                self.template_hashes.pop(stack_name, None)
+                return
+            raise
+        self.stacks[stack_name] = stack
+        body = cf.get_template(StackName=stack_name, TemplateStage='Original')['TemplateBody']
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        self.template_hashes[stack_name] = hashlib.sha256(body.encode()).hexdigest()
+
+    def refresh(self):
+        """Poll stack events concurrently and re-read only the stacks that changed."""
+        names = [d["name"] for d in stack_definitions]
+        with ThreadPoolExecutor(max_workers=len(names)) as pool:
+            changed = {n for n, c in zip(names, pool.map(self.poll_events, names)) if c}
+            self.dirty |= changed
+            dirty = list(self.dirty)
+            list(pool.map(self.refresh_stack, dirty))
+        self.dirty.clear()
+
+    def collected_outputs(self):
+        outputs = {}
+        for stack_def in stack_definitions:
+            stack = self.stacks.get(stack_def["name"], {})
+            for o in stack.get('Outputs', []):
+                if o['OutputKey'] in stack_def.get("outputs", []):
+                    outputs[o['OutputKey']] = o['OutputValue']
+        return outputs
+
+
+# --- Diff and actions ---
+def is_busy(stack):
+    status = stack['StackStatus']
+    return status.endswith(IN_PROGRESS_SUFFIX) and status != change_sets.REVIEW_STATUS
+
+def stack_drift(state, stack_def, collected_outputs):
+    """Return the reason a stack needs a deploy, or None when it is converged."""
+    stack = state.stacks.get(stack_def["name"])
+    if stack is None:
+        return "stack missing"
+    status = stack['StackStatus']
+    if status == change_sets.REVIEW_STATUS:
+        return "stack left in REVIEW_IN_PROGRESS"
+    if is_busy(stack):
+        return None
+    if status.endswith(FAILED_SUFFIXES):
+        logger.error(f"{stack_def['name']} is {status}; manual recovery required.")
+        return None
+    if state.template_hashes.get(stack_def["name"]) != state.local_template_hash(stack_def):
+        return "template changed"
+
+    parameters = pipeline.resolve_parameters(stack_def, collected_outputs, quiet=True)
+    if parameters is None:
+        return None
+    actual = {p['ParameterKey']: p.get('ParameterValue') for p in stack.get('Parameters', [])}
+    changed = [p['ParameterKey'] for p in parameters if actual.get(p['ParameterKey']) != p['ParameterValue']]
+    return f"parameters changed: {', '.join(changed)}" if changed else None
+
+def reconcile_stacks(state):
+    """Start a deploy of the first drifted stack in pipeline order without waiting for it.
+
+    The next passes follow the operation through its stack events; downstream stacks follow once it settled.
+    """
+    collected_outputs = state.collected_outputs()
+    for stack_def in stack_definitions:
+        stack = state.stacks.get(stack_def["name"])
+        if stack and is_busy(stack):
+            return  # Wait for running operations before touching downstream stacks
+        reason = stack_drift(state, stack_def, collected_outputs)
+        if reason is None:
+            continue
+        logger.info(f"[ACTION] deploy {stack_def['name']}: {reason}")
+        if not args.dry_run and pipeline.deploy_stack(stack_def, collected_outputs, wait=False):
+            state.dirty.add(stack_def["name"])
+            state.started.add(stack_def["name"])
+        return
+
+def finish_operations(state):
+    """Run the post-deploy steps of deployment.py once an operation reconcile started has completed.
+
+    GWLBStack republishes its service outputs to the registry, so egress deployments and stackset_rollout.py
+    resolve the current service name; SecurityVPCStack gets its DNS attributes.
+    """
+    for stack_def in stack_definitions:
+        stack = state.stacks.get(stack_def["name"])
+        if stack_def["name"] not in state.started or stack is None or is_busy(stack):
+            continue
+        state.started.discard(stack_def["name"])
+        status = stack['StackStatus']
+        if not status.endswith(COMPLETE_SUFFIX) or status.endswith(FAILED_SUFFIXES):
+            logger.error(f"{stack_def['name']} ended in {status}; post-deploy steps skipped.")
+            continue
+        collected_outputs = state.collected_outputs()
+        if stack_def is deployment.gwlb_stack_definition:
+            deployment.publish_service_registry(collected_outputs, args.registry)
+        elif stack_def is deployment.vpc_stack_definition and "VpcId" in collected_outputs:
+            deployment.set_vpc_dns_attributes(collected_outputs["VpcId"])
+
+def reconcile_routes(state):
+    """Run the route verifier per tenant, with the tenant's profile and region, and apply its corrections.
+
+    Tenant VPCs live in the tenant accounts, so a tenant with vpc_ids needs a "profile" that can describe
+    and replace routes there; without one the current credentials are used (same-account VPCs only).
+    """
+    for tenant in state.tenants:
+        if tenant.get("vpc_ids"):
+            reconcile_tenant_routes(tenant)
+
+def reconcile_tenant_routes(tenant):
+    profile, region = tenant.get("profile"), tenant.get("region", args.region)
+    log = log_pipeline.context_logger(logger, tenant=tenant.get("name", tenant["account_id"]), phase="routes")
+    command = [sys.executable, ROUTE_VERIFIER, "--json", "--region", region]
+    if profile:
+        command += ["--profile", profile]
+    for vpc_id in tenant["vpc_ids"]:
+        command += ["--vpc-id", vpc_id]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode not in (0, 1):
+        log.error(f"Route verifier failed: {result.stderr.strip()}")
+        return
+
+    corrections = json.loads(result.stdout).get("corrections", [])
+    if not corrections:
+        return
+    ec2 = boto3.Session(profile_name=profile, region_name=region).client('ec2')
+    for correction in corrections:
+        log.info(f"[ACTION] route {correction['RouteTableId']} {correction['DestinationCidrBlock']}: "
+                 f"{correction['current']} -> {correction['proposed']}")
+        if args.dry_run:
+            continue
+        target_key = "VpcEndpointId" if correction['proposed'].startswith("vpce-") else "NatGatewayId"
+        try:
+            ec2.replace_route(
+                RouteTableId=correction['RouteTableId'],
+                DestinationCidrBlock=correction['DestinationCidrBlock'],
+                **{target_key: correction['proposed']}
+            )
+        except ClientError as e:
+            log.error(f"Failed to replace route in {correction['RouteTableId']}: {e}")
+
+def reconcile_pass(state):
+    started = time.monotonic()
+    manifest_changed = state.refresh_manifest()
+    state.refresh()
+
+    finish_operations(state)
+    reconcile_stacks(state)
+    if manifest_changed or time.monotonic() - state.last_route_check >= args.route_interval:
+        reconcile_routes(state)
+        state.last_route_check = time.monotonic()
+    logger.debug(f"Reconcile pass finished in {time.monotonic() - started:.2f}s")
+
+if __name__ == "__main__":
+    state = FleetState()
+    logger.info(f"Reconciling {len(stack_definitions)} stack(s) every {args.interval}s")
+    while True:
+        try:
+            reconcile_pass(state)
+        except (ClientError, BotoCoreError, OSError, ValueError) as e:
+            # Transient API or credential errors and a half-written manifest are retried on the next pass
+            logger.error(f"Reconcile pass failed: {e}")
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,90 @@
+import inventory
+
+ACCOUNT, REGION = "111111111111", "ap-southeast-1"
+TG_ARN = "arn:aws:elasticloadbalancing:ap-southeast-1:111111111111:targetgroup/appliances/1"
+AZS = [("ap-southeast-1a", "apse1-az2"), ("ap-southeast-1b", "apse1-az1")]
+
+
+def tenant_network():
+    """One tenant VPC with a GWLBe per AZ and a private route table per AZ pointing at it."""
+    network = {"vpcs": [{"VpcId": "vpc-1", "CidrBlock": "10.100.0.0/16"}],
+               "subnets": [], "route_tables": [], "endpoints": [], "nat_gateways": []}
+    for i, (az, az_id) in enumerate(AZS, start=1):
+        for role, third_octet in (("gwlb", 30 + i), ("private", 10 + i)):
+            network["subnets"].append({
+                "SubnetId": f"subnet-{role}-{i}", "VpcId": "vpc-1", "AvailabilityZone": az, "AvailabilityZoneId": az_id,
+                "CidrBlock": f"10.100.{third_octet}.0/24", "Tags": [{"Key": "Name", "Value": f"egress-{role}-az{i}"}]
+            })
+        network["endpoints"].append({"VpcEndpointId": f"vpce-{i}", "VpcId": "vpc-1", "SubnetIds": [f"subnet-gwlb-{i}"],
+                                     "ServiceName": "com.amazonaws.vpce.svc-1", "State": "available"})
+        network["nat_gateways"].append({"NatGatewayId": f"nat-{i}", "VpcId": "vpc-1", "SubnetId": f"subnet-gwlb-{i}",
+                                        "State": "available"})
+        network["route_tables"].append({
+            "RouteTableId": f"rtb-private-{i}", "VpcId": "vpc-1",
+            "Associations": [{"SubnetId": f"subnet-private-{i}"}],
+            "Routes": [{"DestinationCidrBlock": "0.0.0.0/0", "VpcEndpointId": f"vpce-{i}", "State": "active"},
+                       {"DestinationCidrBlock": "10.100.0.0/16", "GatewayId": "local", "State": "active"}]
+        })
+    return network
+
+
+def target_groups(health_by_target):
+    group = {"TargetGroupArn": TG_ARN, "TargetGroupName": "appliances", "Protocol": "GENEVE", "VpcId": "vpc-perimeter"}
+    health = [{"Target": {"Id": target}, "TargetHealth": {"State": state}}
+              for target, (_, state) in health_by_target.items()]
+    locations = {target: az for target, (az, _) in health_by_target.items()}
+    return [(group, health)], locations
+
+
+def test_tenants_by_az_matches_name_id_and_letter(tmp_path):
+    db = inventory.open_db(str(tmp_path / "inventory.db"))
+    with db:
+        inventory.write_network(db, ACCOUNT, REGION, tenant_network())
+
+    for arg in ("ap-southeast-1b", "apse1-az1", "b"):
+        rows = inventory.run_query(db, "tenants-by-az", arg)
+        assert [(r["vpc_id"], r["endpoint_id"], r["route_table_id"], r["destination"]) for r in rows] == [
+            ("vpc-1", "vpce-2", "rtb-private-2", "0.0.0.0/0")
+        ]
+    nat = db.execute("SELECT subnet_id FROM nat_gateways WHERE nat_gateway_id = 'nat-1'").fetchone()
+    assert nat["subnet_id"] == "subnet-gwlb-1"
+
+
+def test_write_network_replaces_the_vpc_scope(tmp_path):
+    db = inventory.open_db(str(tmp_path / "inventory.db"))
+    network = tenant_network()
+    with db:
+        inventory.write_network(db, ACCOUNT, REGION, network)
+    network["route_tables"] = network["route_tables"][:1]
+    network["endpoints"] = network["endpoints"][:1]
+    with db:
+        inventory.write_network(db, ACCOUNT, REGION, network, vpc_ids={"vpc-1"})
+
+    assert inventory.run_query(db, "tenants-by-az", "b") == []
+    assert [r[0] for r in db.execute("SELECT route_table_id FROM routes")] == ["rtb-private-1", "rtb-private-1"]
+
+
+def test_targets_by_az_counts_health_per_az(tmp_path):
+    db = inventory.open_db(str(tmp_path / "inventory.db"))
+    with db:
+        inventory.write_target_groups(db, ACCOUNT, REGION, target_groups({
+            "i-1": (AZS[0], "healthy"), "i-2": (AZS[0], "healthy"), "i-3": (AZS[1], "unhealthy")
+        }))
+
+    rows = inventory.run_query(db, "targets-by-az", "")
+    assert [(r["az"], r["az_id"], r["health"], r["targets"]) for r in rows] == [
+        ("ap-southeast-1a", "apse1-az2", "healthy", 2), ("ap-southeast-1b", "apse1-az1", "unhealthy", 1)
+    ]
+    assert [r["health"] for r in inventory.run_query(db, "targets-by-az", "apse1-az1")] == ["unhealthy"]
+
+
+def test_write_target_groups_drops_deregistered_targets(tmp_path):
+    db = inventory.open_db(str(tmp_path / "inventory.db"))
+    with db:
+        inventory.write_target_groups(db, ACCOUNT, REGION, target_groups({
+            "i-1": (AZS[0], "healthy"), "i-2": (AZS[1], "healthy")
+        }))
+    with db:
+        inventory.write_target_groups(db, ACCOUNT, REGION, target_groups({"i-2": (AZS[1], "draining")}))
+
+    assert [tuple(r) for r in db.execute("SELECT target_id, health FROM targets")] == [("i-2", "draining")]